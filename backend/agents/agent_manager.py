@@ -2,12 +2,18 @@
 AutoGen多Agent管理器 - AI驱动学习系统的核心
 """
 import asyncio
-from typing import Dict, Any, List, Optional
-from dataclasses import dataclass
+import functools
+import json
+import logging
+import time
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+from dataclasses import dataclass, field
 from enum import Enum
 
 import autogen
 from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
+from aiolimiter import AsyncLimiter
 import structlog
 
 from core.config import settings
@@ -16,9 +22,17 @@ from agents.explanation_agent import ExplanationAgent
 from agents.conversation_agent import ConversationAgent
 from agents.user_profile_agent import UserProfileAgent
 from agents.knowledge_graph_agent import KnowledgeGraphAgent
+from agents.semantic_cache import SemanticCache
+from agents.task_store import TaskStore, TaskRecord
 
 
 logger = structlog.get_logger(__name__)
+# structlog桥接到标准库logging，用于在热路径上提前判断日志级别
+_stdlib_logger = logging.getLogger(__name__)
+
+
+class TaskRejected(Exception):
+    """任务队列已满，拒绝接收新任务"""
 
 
 class AgentType(Enum):
@@ -30,7 +44,11 @@ class AgentType(Enum):
     KNOWLEDGE_GRAPH = "knowledge_graph"
 
 
-@dataclass
+# 执行时会调用LLM生成内容的任务类型，只有这些任务占用LLM请求速率配额
+LLM_AGENT_TYPES = frozenset({AgentType.EXPLANATION, AgentType.CONVERSATION})
+
+
+@dataclass(slots=True)
 class AgentTask:
     """Agent任务数据结构"""
     task_id: str
@@ -39,10 +57,24 @@ class AgentTask:
     task_data: Dict[str, Any]
     priority: int = 1
     created_at: float = None
+    result: Any = None
+    status: str = "pending"
+    error: Optional[str] = None
+    _agent_type_value: str = field(init=False)
     
     def __post_init__(self):
+        self._agent_type_value = self.agent_type.value
         if self.created_at is None:
-            self.created_at = asyncio.get_event_loop().time()
+            self.created_at = time.monotonic()
+
+
+@dataclass(slots=True)
+class PreparedTask:
+    """预处理完成、等待执行的Agent任务"""
+    task: AgentTask
+    cache_namespace: Optional[tuple] = None
+    embedding: Any = None
+    cached_result: Any = None
 
 
 class AgentManager:
@@ -53,29 +85,75 @@ class AgentManager:
     """
     
     def __init__(self):
-        self.agents: Dict[str, Any] = {}
+        self._agent_factories: Dict[AgentType, Callable[[], Awaitable[Any]]] = {}
+        self._agent_cache: Dict[AgentType, Any] = {}
+        self._agent_locks: Dict[AgentType, asyncio.Lock] = {
+            agent_type: asyncio.Lock() for agent_type in AgentType
+        }
+        self.user_proxy: Optional[UserProxyAgent] = None
         self.group_chat: Optional[GroupChat] = None
         self.chat_manager: Optional[GroupChatManager] = None
-        self.task_queue: asyncio.Queue = asyncio.Queue()
-        self.active_tasks: Dict[str, AgentTask] = {}
+        # 按 (-priority, created_at, task_id) 排序，优先级高的任务先执行
+        self.task_queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=settings.agent_queue_max)
+        self.task_store = TaskStore(
+            maxsize=settings.agent_task_store_size,
+            ttl=settings.agent_task_result_ttl
+        )
+        # 预处理完成的任务沿用同样的优先级排序，且最多预取一个批次，
+        # 新到的高优先级任务不会排在大量已预处理的低优先级任务之后
+        self._prep_queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=settings.agent_prepare_batch_size)
+        self._prepare_task: Optional[asyncio.Task] = None
+        # 知识图谱批量更新走独立队列，避免阻塞交互类任务
+        self._kg_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.agent_queue_max)
+        self._workers: List[asyncio.Task] = []
+        self._purge_task: Optional[asyncio.Task] = None
+        # 已提交但尚未结束的任务ID
+        self._inflight: set = set()
+        # 提交时已算好的缓存键与向量，预处理阶段直接复用
+        self._submit_embeddings: Dict[str, Tuple[tuple, Any]] = {}
+        self.cache_hits = 0
         self.is_initialized = False
         
-        # LLM配置
-        self.llm_config = {
-            "config_list": [
-                {
+        # 语义缓存
+        self.semantic_cache: Optional[SemanticCache] = None
+        if settings.semantic_cache_enabled:
+            self.semantic_cache = SemanticCache(
+                model_name=settings.semantic_cache_model,
+                threshold=settings.semantic_cache_threshold,
+                ttl=settings.semantic_cache_ttl,
+                mtm_size=settings.semantic_cache_size
+            )
+        
+        # 主模型提供方的请求速率限制，平滑突发流量，避免429重试风暴
+        self._rate_limiter = AsyncLimiter(max_rate=settings.openai_rpm, time_period=60)
+        
+        # LLM配置（只读模板，Agent各自持有独立副本，避免共享可变状态）
+        self.llm_config = MappingProxyType({
+            "config_list": (
+                MappingProxyType({
                     "model": settings.primary_llm_model,
                     "api_key": settings.openai_api_key,
                     "api_base": settings.openai_api_base,
-                },
-                {
+                }),
+                MappingProxyType({
                     "model": settings.secondary_llm_model,
                     "api_key": settings.anthropic_api_key,
-                }
-            ],
+                })
+            ),
             "cache_seed": settings.autogen_cache_seed,
             "temperature": 0.1,
             "max_tokens": 2000,
+        })
+    
+    def _agent_llm_config(self, with_fallback: bool = False) -> Dict[str, Any]:
+        """生成单个Agent使用的LLM配置副本，默认只包含主模型"""
+        config_list = self.llm_config["config_list"]
+        if not with_fallback:
+            config_list = config_list[:1]
+        
+        return {
+            **self.llm_config,
+            "config_list": [dict(config) for config in config_list]
         }
     
     async def initialize(self):
@@ -83,14 +161,32 @@ class AgentManager:
         try:
             logger.info("🤖 初始化AutoGen多Agent系统...")
             
-            # 初始化各个专业Agent
-            await self._initialize_agents()
+            # 注册各个专业Agent（按需懒加载）
+            self._register_agent_factories()
+            
+            # 加载语义缓存向量模型，加载失败时关闭缓存而不影响启动
+            if self.semantic_cache:
+                try:
+                    await self.semantic_cache.load()
+                except Exception as e:
+                    logger.warning("语义缓存模型加载失败，已关闭语义缓存", error=str(e))
+                    self.semantic_cache = None
             
-            # 设置Group Chat用于Agent协作
-            await self._setup_group_chat()
+            # 设置Group Chat用于Agent协作（默认关闭，任务分发不依赖它）
+            if settings.enable_group_chat:
+                await self._setup_group_chat()
             
-            # 启动任务处理循环
-            asyncio.create_task(self._process_task_queue())
+            # 启动任务预处理循环和固定数量的任务处理Worker
+            self._prepare_task = asyncio.create_task(self._prepare_loop())
+            self._workers = [
+                asyncio.create_task(self._worker_loop(f"worker-{i}", self._prep_queue))
+                for i in range(settings.agent_worker_count)
+            ]
+            # 知识图谱任务由单独的Worker串行处理
+            self._workers.append(asyncio.create_task(self._worker_loop("kg-worker", self._kg_queue)))
+            
+            # 启动过期任务结果清理循环
+            self._purge_task = asyncio.create_task(self._purge_expired_tasks())
             
             self.is_initialized = True
             logger.info("✅ AutoGen Agent系统初始化完成")
@@ -99,11 +195,13 @@ class AgentManager:
             logger.error(f"❌ Agent系统初始化失败: {e}", exc_info=True)
             raise
     
-    async def _initialize_agents(self):
-        """初始化所有专业Agent"""
+    def _register_agent_factories(self):
+        """注册所有专业Agent的构造工厂，Agent在首次使用时才创建"""
         
         # 1. 题目推荐Agent
-        self.agents[AgentType.QUESTION_RECOMMEND.value] = QuestionRecommendAgent(
+        self._agent_factories[AgentType.QUESTION_RECOMMEND] = functools.partial(
+            self._create_agent,
+            QuestionRecommendAgent,
             name="QuestionRecommender",
             system_message="""你是专业的题目推荐专家。
             
@@ -115,11 +213,13 @@ class AgentManager:
 - 个性化学习路径
 
 始终提供精准、个性化的推荐结果。""",
-            llm_config=self.llm_config
+            llm_config=self._agent_llm_config()
         )
         
         # 2. 智能解析Agent
-        self.agents[AgentType.EXPLANATION.value] = ExplanationAgent(
+        self._agent_factories[AgentType.EXPLANATION] = functools.partial(
+            self._create_agent,
+            ExplanationAgent,
             name="ExplanationExpert", 
             system_message="""你是软考题目解析专家。
 
@@ -130,11 +230,13 @@ class AgentManager:
 - 易错点提醒
 
 根据用户水平调整解释的深度和复杂程度。""",
-            llm_config=self.llm_config
+            llm_config=self._agent_llm_config()
         )
         
         # 3. 对话交互Agent
-        self.agents[AgentType.CONVERSATION.value] = ConversationAgent(
+        self._agent_factories[AgentType.CONVERSATION] = functools.partial(
+            self._create_agent,
+            ConversationAgent,
             name="ConversationAssistant",
             system_message="""你是智能学习助手。
 
@@ -145,11 +247,13 @@ class AgentManager:
 - 学习动机激励
 
 保持友好、专业、富有耐心的对话风格。""",
-            llm_config=self.llm_config
+            llm_config=self._agent_llm_config(with_fallback=True)
         )
         
         # 4. 用户画像Agent
-        self.agents[AgentType.USER_PROFILE.value] = UserProfileAgent(
+        self._agent_factories[AgentType.USER_PROFILE] = functools.partial(
+            self._create_agent,
+            UserProfileAgent,
             name="UserProfileAnalyzer",
             system_message="""你是用户行为分析专家。
 
@@ -160,11 +264,13 @@ class AgentManager:
 - 个性化偏好提取
 
 为其他Agent提供准确的用户特征数据。""",
-            llm_config=self.llm_config
+            llm_config=self._agent_llm_config()
         )
         
         # 5. 知识图谱Agent
-        self.agents[AgentType.KNOWLEDGE_GRAPH.value] = KnowledgeGraphAgent(
+        self._agent_factories[AgentType.KNOWLEDGE_GRAPH] = functools.partial(
+            self._create_agent,
+            KnowledgeGraphAgent,
             name="KnowledgeGraphBuilder",
             system_message="""你是软考知识图谱构建专家。
 
@@ -175,10 +281,40 @@ class AgentManager:
 - 历年真题统计分析
 
 为推荐系统提供知识结构支撑。""",
-            llm_config=self.llm_config
+            llm_config=self._agent_llm_config()
         )
         
-        logger.info(f"✅ 成功初始化 {len(self.agents)} 个专业Agent")
+        # 任务分发表
+        self._dispatch = self._build_dispatch_table()
+        
+        logger.info(f"✅ 成功注册 {len(self._agent_factories)} 个专业Agent")
+    
+    async def _get_agent(self, agent_type: AgentType):
+        """获取Agent实例，首次调用时构造并缓存"""
+        agent = self._agent_cache.get(agent_type)
+        if agent is not None:
+            return agent
+        
+        factory = self._agent_factories.get(agent_type)
+        if factory is None:
+            raise ValueError(f"未找到Agent类型: {agent_type.value}")
+        
+        async with self._agent_locks[agent_type]:
+            agent = self._agent_cache.get(agent_type)
+            if agent is None:
+                agent = await factory()
+                self._agent_cache[agent_type] = agent
+                logger.info(f"✅ 专业Agent已创建: {agent_type.value}")
+        
+        return agent
+    
+    @staticmethod
+    async def _create_agent(agent_cls, **kwargs):
+        """在线程池中构造Agent，Agent提供异步setup()时一并执行"""
+        agent = await asyncio.to_thread(agent_cls, **kwargs)
+        if hasattr(agent, 'setup'):
+            await agent.setup()
+        return agent
     
     async def _setup_group_chat(self):
         """设置Group Chat以支持Agent协作"""
@@ -192,8 +328,9 @@ class AgentManager:
                 code_execution_config=False
             )
             
-            # 创建Group Chat
-            agents_list = list(self.agents.values()) + [self.user_proxy]
+            # 创建Group Chat（需要全部Agent，一次性并发构造）
+            agents = await asyncio.gather(*(self._get_agent(t) for t in self._agent_factories))
+            agents_list = list(agents) + [self.user_proxy]
             
             self.group_chat = GroupChat(
                 agents=agents_list,
@@ -205,7 +342,7 @@ class AgentManager:
             # 创建Chat Manager
             self.chat_manager = GroupChatManager(
                 groupchat=self.group_chat,
-                llm_config=self.llm_config,
+                llm_config=self._agent_llm_config(with_fallback=True),
                 system_message="协调各Agent完成复杂的学习任务。"
             )
             
@@ -215,115 +352,289 @@ class AgentManager:
             logger.error(f"❌ Group Chat设置失败: {e}")
             raise
     
-    async def _process_task_queue(self):
-        """处理Agent任务队列"""
+    @staticmethod
+    def _queue_item(task: AgentTask, payload: Any) -> tuple:
+        """按 (-priority, created_at, task_id) 排序的队列元素，payload放在末位"""
+        return (-task.priority, task.created_at, task.task_id, payload)
+    
+    async def _prepare_loop(self):
+        """任务预处理循环：按批取出任务，计算缓存键与向量并查询语义缓存"""
         while True:
+            batch: List[AgentTask] = []
+            forwarded = 0
             try:
-                # 获取任务（阻塞等待）
-                task = await self.task_queue.get()
+                # 阻塞等待首个任务，再取出队列中已就绪的任务凑成一批
+                _, _, _, task = await self.task_queue.get()
+                batch.append(task)
+                while len(batch) < settings.agent_prepare_batch_size and not self.task_queue.empty():
+                    batch.append(self.task_queue.get_nowait()[3])
+                
+                # 执行阶段处理当前批次时，这里已在准备下一批
+                for prepared in await self._prepare_batch(batch):
+                    await self._prep_queue.put(self._queue_item(prepared.task, prepared))
+                    forwarded += 1
                 
-                logger.info(f"🎯 处理Agent任务: {task.task_id} - {task.agent_type.value}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("任务预处理异常", error=str(e), exc_info=True)
+                # 已取出但未转交的任务不带缓存数据交给执行阶段，避免一直停留在pending
+                for task in batch[forwarded:]:
+                    await self._prep_queue.put(self._queue_item(task, PreparedTask(task=task)))
+                await asyncio.sleep(1)
+    
+    async def _prepare_batch(self, tasks: List[AgentTask]) -> List[PreparedTask]:
+        """预处理一批任务，可缓存任务的向量通过一次模型调用批量计算"""
+        prepared = [PreparedTask(task=task) for task in tasks]
+        
+        cacheable = []
+        for item in prepared:
+            precomputed = self._submit_embeddings.pop(item.task.task_id, None)
+            if precomputed is not None:
+                item.cache_namespace, item.embedding = precomputed
+                item.cached_result = self.semantic_cache.get(item.cache_namespace, item.embedding)
+                continue
+            
+            cache_key = self._semantic_cache_key(item.task)
+            if cache_key is None:
+                continue
+            namespace, text = cache_key
+            if text is None:
+                # 精确匹配的任务不需要计算向量
+                item.cache_namespace = namespace
+                item.cached_result = self.semantic_cache.get(namespace, None)
+            else:
+                cacheable.append((item, cache_key))
+        
+        if not cacheable:
+            return prepared
+        
+        try:
+            embeddings = await self.semantic_cache.embed_many([text for _, (_, text) in cacheable])
+        except Exception as e:
+            logger.warning("语义缓存向量计算失败，跳过缓存", error=str(e))
+            return prepared
+        
+        for (item, (namespace, _)), embedding in zip(cacheable, embeddings):
+            item.cache_namespace = namespace
+            item.embedding = embedding
+            item.cached_result = self.semantic_cache.get(namespace, embedding)
+        
+        return prepared
+    
+    async def _worker_loop(self, worker_id: str, source: asyncio.Queue):
+        """任务处理Worker，同一时刻只执行一个任务"""
+        while True:
+            try:
+                # 获取预处理完成的任务（阻塞等待）
+                prepared = (await source.get())[-1]
+                task = prepared.task
                 
-                # 将任务添加到活动任务列表
-                self.active_tasks[task.task_id] = task
+                logger.info("处理Agent任务", worker_id=worker_id, task_id=task.task_id, agent_type=task._agent_type_value)
                 
-                # 异步处理任务
-                asyncio.create_task(self._execute_agent_task(task))
+                # 标记任务为执行中
+                task.status = "running"
+                self.task_store.put(task.task_id, TaskRecord(status=task.status))
                 
-                # 标记任务已完成获取
-                self.task_queue.task_done()
+                await self._execute_agent_task(prepared)
                 
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"❌ 任务队列处理异常: {e}", exc_info=True)
+                logger.error("任务队列处理异常", worker_id=worker_id, error=str(e), exc_info=True)
                 await asyncio.sleep(1)
     
-    async def _execute_agent_task(self, task: AgentTask):
+    async def _execute_agent_task(self, prepared: PreparedTask):
         """执行具体的Agent任务"""
+        task = prepared.task
         try:
-            agent = self.agents.get(task.agent_type.value)
-            if not agent:
-                raise ValueError(f"未找到Agent类型: {task.agent_type.value}")
-            
             # 根据Agent类型执行相应任务
-            result = await self._dispatch_task_to_agent(agent, task)
+            result = await self._dispatch_task_to_agent(prepared)
             
             # 存储任务结果
             task.result = result
             task.status = "completed"
+            self.task_store.put(task.task_id, TaskRecord(
+                status=task.status,
+                result=task.result,
+                finished_at=time.monotonic()
+            ))
             
-            logger.info(f"✅ 任务完成: {task.task_id}")
+            logger.info("任务完成", task_id=task.task_id, agent_type=task._agent_type_value)
             
         except Exception as e:
-            logger.error(f"❌ 任务执行失败: {task.task_id} - {e}", exc_info=True)
-            task.status = "failed" 
+            logger.error("任务执行失败", task_id=task.task_id, agent_type=task._agent_type_value, error=str(e), exc_info=True)
+            task.status = "failed"
             task.error = str(e)
+            self.task_store.put(task.task_id, TaskRecord(
+                status=task.status,
+                error=task.error,
+                finished_at=time.monotonic()
+            ))
         
         finally:
-            # 从活动任务列表中移除
-            if task.task_id in self.active_tasks:
-                del self.active_tasks[task.task_id]
+            self._inflight.discard(task.task_id)
+    
+    async def _purge_expired_tasks(self):
+        """定期清理过期的任务结果"""
+        while True:
+            await asyncio.sleep(settings.agent_task_purge_interval)
+            purged = self.task_store.purge_expired()
+            if purged:
+                logger.debug("清理过期任务结果", purged=purged, remaining=len(self.task_store))
+    
+    async def _dispatch_task_to_agent(self, prepared: PreparedTask) -> Dict[str, Any]:
+        """将任务分发给指定Agent，预处理阶段已命中语义缓存时直接返回"""
+        task = prepared.task
+        if prepared.cached_result is not None:
+            self.cache_hits += 1
+            logger.info("语义缓存命中", task_id=task.task_id, agent_type=task._agent_type_value, cache_hits=self.cache_hits)
+            return prepared.cached_result
+        
+        agent = await self._get_agent(task.agent_type)
+        if task.agent_type in LLM_AGENT_TYPES:
+            async with self._rate_limiter:
+                result = await self._call_agent(agent, task)
+        else:
+            result = await self._call_agent(agent, task)
+        
+        if prepared.cache_namespace is not None and self.semantic_cache is not None:
+            self.semantic_cache.put(prepared.cache_namespace, prepared.embedding, result)
+        return result
     
-    async def _dispatch_task_to_agent(self, agent, task: AgentTask) -> Dict[str, Any]:
-        """将任务分发给指定Agent"""
-        task_type = task.agent_type
+    def _semantic_cache_key(self, task: AgentTask) -> Optional[Tuple[tuple, Optional[str]]]:
+        """
+        构建语义缓存的命名空间和规范化请求文本，不可缓存时返回None
+        
+        文本为None表示按命名空间精确匹配：以ID为键的任务不能按向量相似度复用，
+        相邻ID的文本向量几乎相同，会把一道题的解析返回给另一道题。
+        """
         task_data = task.task_data
+        if self.semantic_cache is None or task_data.get("no_cache"):
+            return None
+        
+        workspace = task_data.get("workspace")
+        
+        if task.agent_type == AgentType.EXPLANATION:
+            user_level = task_data.get("user_level", "intermediate")
+            namespace = (task._agent_type_value, user_level, workspace, task_data.get("question_id"))
+            return namespace, None
+        
+        if task.agent_type == AgentType.CONVERSATION:
+            # 对话回复按用户个性化，只在同一用户内复用
+            namespace = (task._agent_type_value, task.user_id, workspace)
+            context = json.dumps(task_data.get("context", {}), sort_keys=True, ensure_ascii=False, default=str)
+            return namespace, f"{task_data.get('message')}\n{context}"
+        
+        return None
+    
+    async def _call_agent(self, agent, task: AgentTask) -> Dict[str, Any]:
+        """调用Agent执行任务"""
+        try:
+            handler = self._dispatch[task.agent_type]
+        except KeyError:
+            raise ValueError(f"未支持的任务类型: {task.agent_type}") from None
         
-        if task_type == AgentType.QUESTION_RECOMMEND:
-            return await agent.recommend_questions(
+        return await handler(agent, task)
+    
+    @staticmethod
+    def _build_dispatch_table() -> Dict[AgentType, Callable[[Any, AgentTask], Awaitable[Dict[str, Any]]]]:
+        """构建Agent类型到调用方法的分发表"""
+        return {
+            AgentType.QUESTION_RECOMMEND: lambda agent, task: agent.recommend_questions(
                 user_id=task.user_id,
-                num_questions=task_data.get("num_questions", 10),
-                filters=task_data.get("filters", {})
-            )
-            
-        elif task_type == AgentType.EXPLANATION:
-            return await agent.generate_explanation(
-                question_id=task_data.get("question_id"),
-                user_level=task_data.get("user_level", "intermediate")
-            )
-            
-        elif task_type == AgentType.CONVERSATION:
-            return await agent.handle_conversation(
+                num_questions=task.task_data.get("num_questions", 10),
+                filters=task.task_data.get("filters", {})
+            ),
+            AgentType.EXPLANATION: lambda agent, task: agent.generate_explanation(
+                question_id=task.task_data.get("question_id"),
+                user_level=task.task_data.get("user_level", "intermediate")
+            ),
+            AgentType.CONVERSATION: lambda agent, task: agent.handle_conversation(
                 user_id=task.user_id,
-                message=task_data.get("message"),
-                context=task_data.get("context", {})
-            )
-            
-        elif task_type == AgentType.USER_PROFILE:
-            return await agent.update_user_profile(
+                message=task.task_data.get("message"),
+                context=task.task_data.get("context", {})
+            ),
+            AgentType.USER_PROFILE: lambda agent, task: agent.update_user_profile(
                 user_id=task.user_id,
-                interaction_data=task_data.get("interaction_data")
-            )
-            
-        elif task_type == AgentType.KNOWLEDGE_GRAPH:
-            return await agent.update_knowledge_graph(
-                task_data.get("update_type"),
-                task_data.get("data")
-            )
-        
-        else:
-            raise ValueError(f"未支持的任务类型: {task_type}")
+                interaction_data=task.task_data.get("interaction_data")
+            ),
+            AgentType.KNOWLEDGE_GRAPH: lambda agent, task: agent.update_knowledge_graph(
+                task.task_data.get("update_type"),
+                task.task_data.get("data")
+            ),
+        }
     
-    async def submit_task(self, task: AgentTask) -> str:
-        """提交Agent任务"""
+    async def submit_task(self, task: AgentTask, block: bool = False) -> str:
+        """
+        提交Agent任务
+        
+        Args:
+            task: 待执行的任务
+            block: 队列已满时是否等待；为False时直接抛出TaskRejected
+        """
         if not self.is_initialized:
             raise RuntimeError("Agent管理器未初始化")
         
-        await self.task_queue.put(task)
-        logger.info(f"📤 任务已提交: {task.task_id} - {task.agent_type.value}")
+        # 快速路径：命中语义缓存的任务直接完成，不进入队列
+        cache_key = self._semantic_cache_key(task)
+        if cache_key is not None:
+            namespace, text = cache_key
+            try:
+                embedding = None if text is None else await self.semantic_cache.embed(text)
+            except Exception as e:
+                # 向量计算失败不影响任务提交，预处理阶段会再尝试一次
+                logger.warning("语义缓存向量计算失败，跳过缓存", task_id=task.task_id, error=str(e))
+                cache_key = None
+        
+        if cache_key is not None:
+            cached = self.semantic_cache.get(namespace, embedding)
+            if cached is not None:
+                task.result = cached
+                task.status = "completed"
+                self.task_store.put(task.task_id, TaskRecord(
+                    status=task.status,
+                    result=task.result,
+                    finished_at=time.monotonic()
+                ))
+                self.cache_hits += 1
+                logger.info("任务命中语义缓存", task_id=task.task_id, agent_type=task._agent_type_value, cache_hits=self.cache_hits)
+                return task.task_id
+            
+            self._submit_embeddings[task.task_id] = (namespace, embedding)
+        
+        if task.agent_type == AgentType.KNOWLEDGE_GRAPH:
+            queue, item = self._kg_queue, self._queue_item(task, PreparedTask(task=task))
+        else:
+            queue, item = self.task_queue, self._queue_item(task, task)
+        
+        self.task_store.put(task.task_id, TaskRecord(status=task.status))
+        self._inflight.add(task.task_id)
+        
+        if block:
+            await queue.put(item)
+        else:
+            try:
+                queue.put_nowait(item)
+            except asyncio.QueueFull:
+                task.status = "rejected"
+                self.task_store.put(task.task_id, TaskRecord(status=task.status))
+                self._inflight.discard(task.task_id)
+                self._submit_embeddings.pop(task.task_id, None)
+                raise TaskRejected(f"任务队列已满({queue.maxsize})，请稍后重试") from None
+        logger.info("任务已提交", task_id=task.task_id, agent_type=task._agent_type_value)
         
         return task.task_id
     
     async def get_task_result(self, task_id: str) -> Optional[Dict[str, Any]]:
         """获取任务结果"""
-        task = self.active_tasks.get(task_id)
-        if task and hasattr(task, 'result'):
-            return task.result
-        return None
+        record = self.task_store.get(task_id)
+        return record.result if record else None
     
     async def get_task_status(self, task_id: str) -> Optional[str]:
         """获取任务状态"""
-        task = self.active_tasks.get(task_id)
-        return getattr(task, 'status', None) if task else None
+        record = self.task_store.get(task_id)
+        return record.status if record else None
     
     async def health_check(self) -> bool:
         """Agent系统健康检查"""
@@ -332,20 +643,23 @@ class AgentManager:
                 return False
             
             # 检查所有Agent是否正常
-            for agent_type, agent in self.agents.items():
+            for agent in self._agent_cache.values():
                 if not hasattr(agent, 'name'):
                     return False
             
-            # 检查任务队列是否正常
-            queue_size = self.task_queue.qsize()
-            active_tasks = len(self.active_tasks)
-            
-            logger.debug(f"Agent系统状态: 队列大小={queue_size}, 活跃任务={active_tasks}")
+            # 检查任务队列是否正常（仅在DEBUG级别开启时统计）
+            if _stdlib_logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Agent系统状态",
+                    queue_size=self.task_queue.qsize(),
+                    stored_tasks=len(self.task_store),
+                    cache_hits=self.cache_hits
+                )
             
             return True
             
         except Exception as e:
-            logger.error(f"Agent健康检查失败: {e}")
+            logger.error("Agent健康检查失败", error=str(e))
             return False
     
     async def cleanup(self):
@@ -353,17 +667,36 @@ class AgentManager:
         try:
             logger.info("🧹 清理Agent系统...")
             
-            # 等待所有任务完成
-            if not self.task_queue.empty():
-                await self.task_queue.join()
+            # 等待已提交的任务执行完成（超时后放弃等待）
+            deadline = time.monotonic() + settings.agent_shutdown_timeout
+            while self._inflight and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            if self._inflight:
+                logger.warning(f"⚠️ 仍有 {len(self._inflight)} 个任务未完成，强制停止")
+            
+            # 停止任务预处理循环和任务处理Worker
+            loops = self._workers + ([self._prepare_task] if self._prepare_task else [])
+            for loop_task in loops:
+                loop_task.cancel()
+            await asyncio.gather(*loops, return_exceptions=True)
+            self._workers.clear()
+            self._prepare_task = None
+            
+            # 并发清理Agent资源
+            await asyncio.gather(*(
+                agent.cleanup()
+                for agent in self._agent_cache.values()
+                if hasattr(agent, 'cleanup')
+            ))
             
-            # 清理Agent资源
-            for agent_type, agent in self.agents.items():
-                if hasattr(agent, 'cleanup'):
-                    await agent.cleanup()
+            if self._purge_task:
+                self._purge_task.cancel()
             
-            self.agents.clear()
-            self.active_tasks.clear()
+            self._agent_cache.clear()
+            self.task_store.clear()
+            
+            if self.semantic_cache:
+                self.semantic_cache.clear()
             
             logger.info("✅ Agent系统清理完成")
             
@@ -371,12 +704,7 @@ class AgentManager:
             logger.error(f"❌ Agent系统清理失败: {e}")
 
 
-# 单例模式的Agent管理器实例
-agent_manager_instance = None
-
+@functools.lru_cache(maxsize=1)
 def get_agent_manager() -> AgentManager:
-    """获取Agent管理器单例"""
-    global agent_manager_instance
-    if agent_manager_instance is None:
-        agent_manager_instance = AgentManager()
-    return agent_manager_instance
\ No newline at end of file
+    """获取Agent管理器单例（测试中可通过 get_agent_manager.cache_clear() 重置）"""
+    return AgentManager()
\ No newline at end of file
@@ -2,17 +2,22 @@
 题目推荐Agent - 基于用户画像的智能推荐系统
 """
 import asyncio
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import datetime
 
+import msgpack
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
+from cachetools import TTLCache
+from scipy import sparse
+from sklearn.cluster import KMeans
+from sklearn.feature_extraction.text import HashingVectorizer
 import structlog
 from autogen import AssistantAgent
 
 from core.config import settings
+from agents.recommendation_cache import RedisRecommendationCache
 from models.question import Question, QuestionDifficulty, QuestionType
 from models.user_profile import UserProfile, LearningPreference
 from services.database_service import DatabaseService
@@ -49,6 +54,132 @@ class QuestionRecommendation:
     recommendation_type: str  # "collaborative", "content", "knowledge_graph", "hybrid"
 
 
+# 推荐类型编码，按列存储时以int8保存
+RECOMMENDATION_TYPES = (
+    "collaborative", "content_based", "knowledge_graph", "user_preference",
+    "hybrid", "new_user", "fallback"
+)
+RECOMMENDATION_TYPE_CODES = {name: code for code, name in enumerate(RECOMMENDATION_TYPES)}
+
+# 各推荐算法的推荐理由与置信度
+ALGORITHM_PROFILES = {
+    "collaborative": ("基于相似用户的学习偏好推荐", 0.8),
+    "content_based": ("基于题目内容相似度推荐", 0.75),
+    "knowledge_graph": ("针对薄弱知识点的定向推荐", 0.85),
+    "user_preference": ("基于个人学习偏好推荐", 0.7),
+}
+
+# 推荐算法无候选时的返回值：(题目ID数组, 分数数组)
+EMPTY_CANDIDATES: Tuple[np.ndarray, np.ndarray] = (
+    np.empty(0, dtype=object), np.empty(0, dtype=np.float32)
+)
+
+# 进程内共享的题目表（LRU + TTL兜底），各用户的推荐缓存只保存题目ID
+question_table: "TTLCache[str, Question]" = TTLCache(
+    maxsize=settings.question_cache_size,
+    ttl=settings.question_cache_ttl
+)
+
+
+@dataclass
+class RecommendationColumns:
+    """按列存储的推荐结果，后处理和缓存只操作连续的分数/ID数组"""
+    question_ids: np.ndarray  # object
+    scores: np.ndarray  # float32
+    confidences: np.ndarray  # float32
+    reasons: List[str]
+    rec_types: np.ndarray  # int8
+
+    def __len__(self) -> int:
+        return len(self.question_ids)
+
+    @classmethod
+    def from_recommendations(cls, recommendations: List[QuestionRecommendation]) -> "RecommendationColumns":
+        """由推荐对象列表构建列存储，并登记题目到共享题目表"""
+        count = len(recommendations)
+        question_ids = np.empty(count, dtype=object)
+        scores = np.empty(count, dtype=np.float32)
+        confidences = np.empty(count, dtype=np.float32)
+        rec_types = np.empty(count, dtype=np.int8)
+        reasons = []
+
+        for i, rec in enumerate(recommendations):
+            question_table[rec.question_id] = rec.question
+            question_ids[i] = rec.question_id
+            scores[i] = rec.score
+            confidences[i] = rec.confidence
+            rec_types[i] = RECOMMENDATION_TYPE_CODES[rec.recommendation_type]
+            reasons.append(rec.reason)
+
+        return cls(question_ids, scores, confidences, reasons, rec_types)
+
+    def take(self, indices: np.ndarray) -> "RecommendationColumns":
+        """按索引选取子集（保持索引顺序）"""
+        return RecommendationColumns(
+            question_ids=self.question_ids[indices],
+            scores=self.scores[indices],
+            confidences=self.confidences[indices],
+            reasons=[self.reasons[i] for i in indices],
+            rec_types=self.rec_types[indices]
+        )
+
+    @classmethod
+    def empty(cls) -> "RecommendationColumns":
+        """空的列存储"""
+        return cls(
+            question_ids=np.empty(0, dtype=object),
+            scores=np.empty(0, dtype=np.float32),
+            confidences=np.empty(0, dtype=np.float32),
+            reasons=[],
+            rec_types=np.empty(0, dtype=np.int8)
+        )
+
+    def to_msgpack(self) -> bytes:
+        """序列化为msgpack，数值列直接保存原始字节"""
+        return msgpack.packb({
+            "question_ids": list(self.question_ids),
+            "scores": self.scores.tobytes(),
+            "confidences": self.confidences.tobytes(),
+            "reasons": self.reasons,
+            "rec_types": self.rec_types.tobytes()
+        })
+
+    @classmethod
+    def from_msgpack(cls, payload: bytes) -> "RecommendationColumns":
+        """由msgpack字节串还原列存储"""
+        data = msgpack.unpackb(payload)
+        question_ids = np.empty(len(data["question_ids"]), dtype=object)
+        question_ids[:] = data["question_ids"]
+        return cls(
+            question_ids=question_ids,
+            scores=np.frombuffer(data["scores"], dtype=np.float32),
+            confidences=np.frombuffer(data["confidences"], dtype=np.float32),
+            reasons=data["reasons"],
+            rec_types=np.frombuffer(data["rec_types"], dtype=np.int8)
+        )
+
+    def to_recommendations(self, questions: Dict[str, Question]) -> List[QuestionRecommendation]:
+        """
+        还原为推荐对象列表（仅在返回结果时调用）
+
+        questions 为本次请求批量查询得到的题目，不读共享题目表：
+        其中的条目可能在查询之后过期淘汰。
+        """
+        return [
+            QuestionRecommendation(
+                question_id=question_id,
+                question=questions[question_id],
+                score=float(score),
+                reason=reason,
+                confidence=float(confidence),
+                recommendation_type=RECOMMENDATION_TYPES[rec_type]
+            )
+            for question_id, score, reason, confidence, rec_type in zip(
+                self.question_ids, self.scores, self.reasons, self.confidences, self.rec_types
+            )
+        ]
+
+
 class QuestionRecommendAgent(AssistantAgent):
     """
     题目推荐Agent
@@ -56,9 +187,22 @@ class QuestionRecommendAgent(AssistantAgent):
     使用多种推荐算法为用户智能推荐最适合的学习题目
     """
     
+    # 无状态的哈希向量化器，不需要拟合词表，所有请求共享
+    question_vectorizer = HashingVectorizer(
+        analyzer="char_wb",
+        ngram_range=(1, 2),
+        n_features=settings.question_corpus_n_features,
+        alternate_sign=False,
+        norm="l2",
+        dtype=np.float32
+    )
+    
     def __init__(self, name: str, system_message: str, llm_config: Dict):
         super().__init__(name=name, system_message=system_message, llm_config=llm_config)
         
+        # 预先绑定组件上下文的日志器
+        self.log = logger.bind(component="question_recommend")
+        
         self.db_service = DatabaseService()
         self.vector_service = VectorService()
         
@@ -67,10 +211,24 @@ class QuestionRecommendAgent(AssistantAgent):
         self.content_recommender = ContentBasedRecommender()
         self.hybrid_recommender = HybridRecommender()
         
-        # 推荐缓存
-        self.recommendation_cache: Dict[str, List[QuestionRecommendation]] = {}
-        self.cache_ttl = timedelta(hours=1)
-        self.last_cache_update: Dict[str, datetime] = {}
+        # 推荐缓存：进程内L1应对突发请求，Redis L2在多个Worker间共享
+        # L1按用户分组：user_id -> {数量分桶: (写入时间, 推荐列)}，失效时整组删除
+        self.recommendation_cache: "TTLCache[str, Dict[int, Tuple[float, RecommendationColumns]]]" = TTLCache(
+            maxsize=settings.recommendation_l1_cache_size,
+            ttl=settings.recommendation_l1_cache_ttl
+        )
+        self.shared_cache = RedisRecommendationCache(
+            settings.redis_url, ttl=settings.recommendation_cache_ttl
+        )
+        
+        # 题库稀疏特征矩阵（懒加载，题库变化时增量更新）
+        self._corpus_matrix: Optional[sparse.csr_matrix] = None
+        self._corpus_question_ids: List[str] = []
+        self._corpus_version: Optional[Tuple] = None
+        self._corpus_checked_at = 0.0
+        
+        # 正在查询中的题目ID -> 查询结果，合并并发请求对同一题目的查询
+        self._pending_questions: Dict[str, asyncio.Future] = {}
         
         # 推荐权重配置
         self.algorithm_weights = {
@@ -98,12 +256,12 @@ class QuestionRecommendAgent(AssistantAgent):
             推荐题目列表
         """
         try:
-            logger.info(f"🎯 开始为用户 {user_id} 推荐 {num_questions} 道题目")
+            self.log.info("🎯 开始推荐题目", user_id=user_id, num_questions=num_questions)
             
             # 检查缓存
-            cached_recommendations = await self._get_cached_recommendations(user_id)
+            cached_recommendations = await self._get_cached_recommendations(user_id, num_questions)
             if cached_recommendations and len(cached_recommendations) >= num_questions:
-                logger.info(f"📋 使用缓存推荐结果")
+                self.log.info("📋 使用缓存推荐结果", user_id=user_id)
                 return cached_recommendations[:num_questions]
             
             # 构建推荐请求
@@ -120,28 +278,74 @@ class QuestionRecommendAgent(AssistantAgent):
                 return await self._recommend_for_new_user(request)
             
             # 多算法并行推荐
-            recommendations = await self._generate_hybrid_recommendations(request, user_profile)
+            candidates, questions = await self._generate_hybrid_recommendations(request, user_profile)
             
             # 后处理：去重、排序、多样性优化
             final_recommendations = await self._post_process_recommendations(
-                recommendations, request, user_profile
+                candidates, questions, request, user_profile
             )
             
             # 更新缓存
-            await self._update_recommendation_cache(user_id, final_recommendations)
+            await self._update_recommendation_cache(user_id, num_questions, final_recommendations)
             
             # 记录推荐日志
             await self._log_recommendation_event(user_id, final_recommendations)
             
-            logger.info(f"✅ 推荐完成，返回 {len(final_recommendations)} 道题目")
+            self.log.info("✅ 推荐完成", user_id=user_id, count=len(final_recommendations))
             
             return final_recommendations[:num_questions]
             
         except Exception as e:
-            logger.error(f"❌ 题目推荐失败: {e}", exc_info=True)
+            self.log.error("❌ 题目推荐失败", user_id=user_id, error=str(e), exc_info=True)
             # 降级处理：返回热门题目
             return await self._fallback_recommendation(user_id, num_questions)
     
+    async def _get_cached_recommendations(
+        self,
+        user_id: str,
+        num_questions: int
+    ) -> Optional[List[QuestionRecommendation]]:
+        """依次查询L1和Redis L2缓存，返回未过期的推荐结果"""
+        bucket = RedisRecommendationCache.bucket(num_questions)
+        columns = self._get_l1_recommendations(user_id, bucket)
+        if columns is None:
+            payload = await self.shared_cache.get(user_id, num_questions)
+            if payload is None:
+                return None
+            columns = RecommendationColumns.from_msgpack(payload)
+            self._set_l1_recommendations(user_id, bucket, columns)
+        
+        # 缓存只保存题目ID，题目表中缺失或已淘汰的题目批量补齐
+        questions = await self._get_questions_by_ids(list(columns.question_ids))
+        if any(question_id not in questions for question_id in columns.question_ids):
+            return None
+        
+        return columns.to_recommendations(questions)
+    
+    async def _update_recommendation_cache(
+        self,
+        user_id: str,
+        num_questions: int,
+        recommendations: List[QuestionRecommendation]
+    ):
+        """以列存储形式写入L1缓存，并将msgpack序列化结果写入Redis L2"""
+        columns = RecommendationColumns.from_recommendations(recommendations)
+        self._set_l1_recommendations(user_id, RedisRecommendationCache.bucket(num_questions), columns)
+        await self.shared_cache.set(user_id, num_questions, columns.to_msgpack())
+    
+    def _get_l1_recommendations(self, user_id: str, bucket: int) -> Optional[RecommendationColumns]:
+        """读取L1中用户某个分桶的推荐，分桶各自按写入时间判断过期"""
+        entry = self.recommendation_cache.get(user_id, {}).get(bucket)
+        if entry is None or time.monotonic() - entry[0] >= settings.recommendation_l1_cache_ttl:
+            return None
+        return entry[1]
+    
+    def _set_l1_recommendations(self, user_id: str, bucket: int, columns: RecommendationColumns):
+        """写入L1，同一用户的其他分桶保持原写入时间"""
+        buckets = dict(self.recommendation_cache.get(user_id, {}))
+        buckets[bucket] = (time.monotonic(), columns)
+        self.recommendation_cache[user_id] = buckets
+    
     async def _get_user_profile(self, user_id: str) -> Optional[UserProfile]:
         """获取用户画像"""
         try:
@@ -160,130 +364,376 @@ class QuestionRecommendAgent(AssistantAgent):
             return None
             
         except Exception as e:
-            logger.error(f"获取用户画像失败: {e}")
+            self.log.error("获取用户画像失败", user_id=user_id, error=str(e))
             return None
     
     async def _generate_hybrid_recommendations(
         self, 
         request: RecommendationRequest,
         user_profile: UserProfile
-    ) -> List[QuestionRecommendation]:
-        """生成混合推荐结果"""
+    ) -> Tuple[RecommendationColumns, Dict[str, Question]]:
+        """生成混合推荐候选，返回列存储的候选及候选题目 question_id -> Question"""
         
-        # 并行执行多种推荐算法
-        collaborative_task = self._collaborative_filtering_recommend(request, user_profile)
-        content_task = self._content_based_recommend(request, user_profile)
-        knowledge_graph_task = self._knowledge_graph_recommend(request, user_profile)
-        preference_task = self._user_preference_recommend(request, user_profile)
+        # 并行执行多种推荐算法，各算法只返回候选题目ID和分数；权重为0的算法不调度
+        algorithm_methods = {
+            "collaborative": self._collaborative_filtering_recommend,
+            "content_based": self._content_based_recommend,
+            "knowledge_graph": self._knowledge_graph_recommend,
+            "user_preference": self._user_preference_recommend
+        }
+        algorithm_names = [
+            name for name in algorithm_methods if self.algorithm_weights.get(name, 0) > 0
+        ]
+        tasks = [
+            asyncio.create_task(algorithm_methods[name](request, user_profile))
+            for name in algorithm_names
+        ]
         
         # 等待所有算法完成
-        results = await asyncio.gather(
-            collaborative_task,
-            content_task, 
-            knowledge_graph_task,
-            preference_task,
-            return_exceptions=True
-        )
+        results = await asyncio.gather(*tasks, return_exceptions=True)
         
-        # 整合推荐结果
-        all_recommendations = []
-        algorithm_names = ["collaborative", "content_based", "knowledge_graph", "user_preference"]
+        candidates_by_algorithm: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
         
-        for i, result in enumerate(results):
+        for name, result in zip(algorithm_names, results):
             if isinstance(result, Exception):
-                logger.warning(f"{algorithm_names[i]} 推荐算法失败: {result}")
+                self.log.warning("推荐算法失败", algorithm=name, error=str(result))
                 continue
             
-            if result:
-                all_recommendations.extend(result)
+            if len(result[0]):
+                candidates_by_algorithm[name] = result
+        
+        if not candidates_by_algorithm:
+            return RecommendationColumns.empty(), {}
+        
+        # 各算法候选直接拼接为列，权重乘法对整列进行
+        question_ids = np.concatenate([ids for ids, _ in candidates_by_algorithm.values()])
+        scores = np.concatenate([
+            scores * np.float32(self.algorithm_weights[name])
+            for name, (_, scores) in candidates_by_algorithm.items()
+        ])
+        confidences = np.concatenate([
+            np.full(len(ids), ALGORITHM_PROFILES[name][1], dtype=np.float32)
+            for name, (ids, _) in candidates_by_algorithm.items()
+        ])
+        rec_types = np.concatenate([
+            np.full(len(ids), RECOMMENDATION_TYPE_CODES[name], dtype=np.int8)
+            for name, (ids, _) in candidates_by_algorithm.items()
+        ])
+        reasons = [
+            ALGORITHM_PROFILES[name][0]
+            for name, (ids, _) in candidates_by_algorithm.items()
+            for _ in range(len(ids))
+        ]
+        columns = RecommendationColumns(question_ids, scores, confidences, reasons, rec_types)
+        
+        # 各算法候选重叠较多，合并后一次性批量查询题目，查不到的候选丢弃
+        questions = await self._get_questions_by_ids(list(dict.fromkeys(question_ids)))
+        found = np.fromiter(
+            (question_id in questions for question_id in question_ids), dtype=bool, count=len(question_ids)
+        )
+        
+        return columns.take(np.flatnonzero(found)), questions
+    
+    async def _get_questions_by_ids(self, question_ids: List[str]) -> Dict[str, Question]:
+        """
+        批量获取题目，返回 question_id -> Question
+        
+        优先读取共享题目表，缺失的题目合并为一次查询；其他请求正在查询的
+        题目直接等待其结果，不重复查询。
+        """
+        questions: Dict[str, Question] = {}
+        missing: List[str] = []
+        waiting: Dict[str, asyncio.Future] = {}
         
-        return all_recommendations
+        for question_id in question_ids:
+            question = question_table.get(question_id)
+            if question is not None:
+                questions[question_id] = question
+            elif question_id in self._pending_questions:
+                waiting[question_id] = self._pending_questions[question_id]
+            else:
+                missing.append(question_id)
+        
+        if missing:
+            future = asyncio.get_running_loop().create_future()
+            for question_id in missing:
+                self._pending_questions[question_id] = future
+            
+            fetched: Dict[str, Question] = {}
+            try:
+                query = "SELECT * FROM questions WHERE id = ANY($1::uuid[])"
+                records = await self.db_service.fetch_all(query, missing)
+                for record in records:
+                    question = Question.from_db_record(record)
+                    fetched[str(question.id)] = question
+                question_table.update(fetched)
+            finally:
+                # 查询失败时等待方按未找到处理，异常只抛给发起查询的请求
+                future.set_result(fetched)
+                for question_id in missing:
+                    self._pending_questions.pop(question_id, None)
+            questions.update(fetched)
+        
+        for question_id, pending in waiting.items():
+            question = (await pending).get(question_id)
+            if question is not None:
+                questions[question_id] = question
+        
+        return questions
+    
+    def invalidate_question(self, question_id: str):
+        """题目被修改时从共享题目表中移除"""
+        question_table.pop(question_id, None)
+    
+    @staticmethod
+    def _candidate_arrays(candidates: List[Tuple[str, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """将(题目ID, 分数)列表转换为两列数组"""
+        question_ids = np.empty(len(candidates), dtype=object)
+        question_ids[:] = [question_id for question_id, _ in candidates]
+        scores = np.fromiter((score for _, score in candidates), dtype=np.float32, count=len(candidates))
+        return question_ids, scores
     
     async def _collaborative_filtering_recommend(
         self, 
         request: RecommendationRequest,
         user_profile: UserProfile
-    ) -> List[QuestionRecommendation]:
-        """协同过滤推荐"""
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """协同过滤推荐，返回候选题目ID及分数"""
         try:
             # 获取相似用户
             similar_users = await self._find_similar_users(request.user_id, user_profile)
             
             if not similar_users:
-                return []
+                return EMPTY_CANDIDATES
             
             # 获取相似用户喜欢的题目
             candidate_questions = await self._get_questions_liked_by_similar_users(
                 similar_users, request
             )
             
-            recommendations = []
-            for question_id, score in candidate_questions[:request.num_questions * 2]:
-                question = await self._get_question_by_id(question_id)
-                if question:
-                    recommendations.append(QuestionRecommendation(
-                        question_id=question_id,
-                        question=question,
-                        score=score * self.algorithm_weights["collaborative"],
-                        reason="基于相似用户的学习偏好推荐",
-                        confidence=0.8,
-                        recommendation_type="collaborative"
-                    ))
-            
-            logger.debug(f"协同过滤推荐 {len(recommendations)} 道题目")
-            return recommendations
+            candidates = self._candidate_arrays(candidate_questions[:request.num_questions * 2])
+            
+            self.log.debug("协同过滤推荐候选", count=len(candidates[0]))
+            return candidates
             
         except Exception as e:
-            logger.error(f"协同过滤推荐失败: {e}")
-            return []
+            self.log.error("协同过滤推荐失败", error=str(e))
+            return EMPTY_CANDIDATES
+    
+    async def _find_similar_users(
+        self,
+        user_id: str,
+        user_profile: UserProfile
+    ) -> List[Tuple[str, float]]:
+        """通过用户画像向量索引的近似最近邻检索查找相似用户，结果缓存在Redis中"""
+        cached = await self.shared_cache.get_similar_users(user_id)
+        if cached is not None:
+            return [(similar_id, score) for similar_id, score in msgpack.unpackb(cached)]
+        
+        # 多取一个，结果中包含用户本身
+        hits = await self.vector_service.search(
+            collection=settings.user_profile_collection,
+            vector=user_profile.to_vector(),
+            limit=settings.similar_users_top_k + 1
+        )
+        similar_users = [
+            (str(hit.id), float(hit.score)) for hit in hits if str(hit.id) != user_id
+        ][:settings.similar_users_top_k]
+        
+        await self.shared_cache.set_similar_users(
+            user_id, msgpack.packb(similar_users), ttl=settings.similar_users_cache_ttl
+        )
+        return similar_users
+    
+    async def _get_questions_liked_by_similar_users(
+        self,
+        similar_users: List[Tuple[str, float]],
+        request: RecommendationRequest
+    ) -> List[Tuple[str, float]]:
+        """
+        查询相似用户答对的题目，按相似度加权求和打分
+        
+        相似用户列表以数组参数传入，在同一条CTE查询中完成关联、过滤和聚合
+        """
+        query = """
+        WITH sim AS (
+            SELECT peer_id, similarity
+            FROM unnest($1::uuid[], $2::float8[]) AS s(peer_id, similarity)
+        )
+        SELECT lr.question_id, SUM(sim.similarity) AS score
+        FROM sim
+        JOIN learning_records lr ON lr.user_id = sim.peer_id
+        WHERE lr.is_correct
+          AND NOT ($3 AND EXISTS (
+              SELECT 1 FROM learning_records own
+              WHERE own.user_id = $4 AND own.question_id = lr.question_id
+          ))
+        GROUP BY lr.question_id
+        ORDER BY score DESC
+        LIMIT $5
+        """
+        
+        records = await self.db_service.fetch_all(
+            query,
+            [user_id for user_id, _ in similar_users],
+            [similarity for _, similarity in similar_users],
+            request.exclude_answered,
+            request.user_id,
+            request.num_questions * 2
+        )
+        return [(str(record["question_id"]), float(record["score"])) for record in records]
+    
+    async def update_user_profile_vector(self, user_profile: UserProfile):
+        """用户画像更新后写入向量索引，并使其相似用户缓存失效"""
+        await self.vector_service.upsert(
+            collection=settings.user_profile_collection,
+            point_id=user_profile.user_id,
+            vector=user_profile.to_vector()
+        )
+        await self.shared_cache.invalidate_similar_users(user_profile.user_id)
     
     async def _content_based_recommend(
         self,
         request: RecommendationRequest, 
         user_profile: UserProfile
-    ) -> List[QuestionRecommendation]:
-        """基于内容的推荐"""
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        基于内容的推荐，返回候选题目ID及相似度
+        
+        偏好特征中的 profile_text 是描述用户偏好的文本，与题目内容做相似度匹配；
+        未提供或为空时，以用户答过的题目在题库特征矩阵中的质心作为查询向量。
+        """
         try:
             # 获取用户历史答题记录
             user_history = await self._get_user_answer_history(request.user_id)
             
             if not user_history:
-                return []
+                return EMPTY_CANDIDATES
             
             # 分析用户偏好的题目特征
-            preferred_features = await self._extract_preferred_features(user_history)
+            preferred_features, answered_ids = await asyncio.gather(
+                self._extract_preferred_features(user_history),
+                self._get_answered_question_ids(request.user_id)
+            )
             
             # 基于特征相似度推荐题目
             candidate_questions = await self._find_similar_questions_by_features(
-                preferred_features, request
+                preferred_features, answered_ids, request
             )
             
-            recommendations = []
-            for question_id, similarity in candidate_questions[:request.num_questions * 2]:
-                question = await self._get_question_by_id(question_id)
-                if question:
-                    recommendations.append(QuestionRecommendation(
-                        question_id=question_id,
-                        question=question,
-                        score=similarity * self.algorithm_weights["content_based"],
-                        reason="基于题目内容相似度推荐",
-                        confidence=0.75,
-                        recommendation_type="content_based"
-                    ))
-            
-            logger.debug(f"内容推荐 {len(recommendations)} 道题目")
-            return recommendations
+            candidates = self._candidate_arrays(candidate_questions[:request.num_questions * 2])
+            
+            self.log.debug("内容推荐候选", count=len(candidates[0]))
+            return candidates
             
         except Exception as e:
-            logger.error(f"内容推荐失败: {e}")
+            self.log.error("内容推荐失败", error=str(e))
+            return EMPTY_CANDIDATES
+    
+    async def _get_answered_question_ids(self, user_id: str) -> List[str]:
+        """查询用户答过的全部题目ID"""
+        records = await self.db_service.fetch_all(
+            "SELECT DISTINCT question_id FROM learning_records WHERE user_id = $1", user_id
+        )
+        return [str(record["question_id"]) for record in records]
+    
+    async def _find_similar_questions_by_features(
+        self,
+        preferred_features: Dict[str, Any],
+        answered_ids: List[str],
+        request: RecommendationRequest
+    ) -> List[Tuple[str, float]]:
+        """基于用户偏好与题库特征矩阵的余弦相似度查找候选题目，查询向量为空时不返回候选"""
+        await self._ensure_question_corpus()
+        if self._corpus_matrix is None or not self._corpus_question_ids:
             return []
+        
+        answered_mask = np.isin(np.asarray(self._corpus_question_ids), answered_ids)
+        
+        # 行向量均已L2归一化，稀疏矩阵乘单位向量即为余弦相似度
+        profile_text = preferred_features.get("profile_text")
+        if profile_text:
+            query = self.question_vectorizer.transform([profile_text])
+            if query.nnz == 0:
+                return []
+            similarities = (self._corpus_matrix @ query.T).toarray().ravel()
+        else:
+            if not answered_mask.any():
+                return []
+            centroid = np.asarray(self._corpus_matrix[answered_mask].sum(axis=0)).ravel()
+            norm = np.linalg.norm(centroid)
+            if norm == 0:
+                return []
+            similarities = self._corpus_matrix @ (centroid / norm)
+        
+        # 与协同过滤一致，排除用户已答过的题目
+        if request.exclude_answered:
+            similarities[answered_mask] = -np.inf
+        
+        # argpartition取top-k，只对top-k排序；相似度不为正的题目不作为候选
+        top_k = min(request.num_questions * 2, len(similarities))
+        top_idx = np.argpartition(-similarities, top_k - 1)[:top_k]
+        top_idx = top_idx[np.argsort(-similarities[top_idx])]
+        top_idx = top_idx[similarities[top_idx] > 0]
+        
+        return [(self._corpus_question_ids[i], float(similarities[i])) for i in top_idx]
+    
+    async def _ensure_question_corpus(self):
+        """按需构建题库特征矩阵，定期检查题库版本，只哈希新增或修改的题目"""
+        now = time.monotonic()
+        if self._corpus_matrix is not None and now - self._corpus_checked_at < settings.question_corpus_check_interval:
+            return
+        self._corpus_checked_at = now
+        
+        version_record = await self.db_service.fetch_one(
+            "SELECT COUNT(*) AS total, MAX(updated_at) AS last_updated FROM questions"
+        )
+        version = (version_record["total"], version_record["last_updated"])
+        if self._corpus_matrix is not None and version == self._corpus_version:
+            return
+        
+        if self._corpus_matrix is not None:
+            records = await self.db_service.fetch_all(
+                "SELECT id, content FROM questions WHERE updated_at > $1",
+                self._corpus_version[1]
+            )
+            changed_ids = [str(record["id"]) for record in records]
+            rows = await asyncio.to_thread(
+                self.question_vectorizer.transform, [record["content"] for record in records]
+            )
+            changed = set(changed_ids)
+            for question_id in changed_ids:
+                self.invalidate_question(question_id)
+            keep = [i for i, question_id in enumerate(self._corpus_question_ids) if question_id not in changed]
+            self._corpus_matrix = sparse.vstack([self._corpus_matrix[keep], rows], format="csr")
+            self._corpus_question_ids = [self._corpus_question_ids[i] for i in keep] + changed_ids
+            self._corpus_version = version
+            
+            # 数量对不上说明有题目被删除，退回全量构建
+            if len(self._corpus_question_ids) == version[0]:
+                self.log.info("题库特征矩阵增量更新", changed=len(changed_ids))
+                return
+        
+        records = await self.db_service.fetch_all("SELECT id, content FROM questions")
+        if not records:
+            self._corpus_matrix = None
+            self._corpus_question_ids = []
+            return
+        
+        self._corpus_matrix = await asyncio.to_thread(
+            self.question_vectorizer.transform, [record["content"] for record in records]
+        )
+        self._corpus_question_ids = [str(record["id"]) for record in records]
+        self._corpus_version = version
+        
+        self.log.info("题库特征矩阵已重建", shape=self._corpus_matrix.shape)
     
     async def _knowledge_graph_recommend(
         self,
         request: RecommendationRequest,
         user_profile: UserProfile
-    ) -> List[QuestionRecommendation]:
-        """基于知识图谱的推荐"""
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """基于知识图谱的推荐，返回候选题目ID及相关度"""
         try:
             # 获取用户薄弱知识点
             weak_knowledge_points = await self._identify_weak_knowledge_points(
@@ -291,39 +741,28 @@ class QuestionRecommendAgent(AssistantAgent):
             )
             
             if not weak_knowledge_points:
-                return []
+                return EMPTY_CANDIDATES
             
             # 基于知识图谱找到相关题目
             related_questions = await self._find_questions_by_knowledge_points(
                 weak_knowledge_points, request
             )
             
-            recommendations = []
-            for question_id, relevance in related_questions[:request.num_questions * 2]:
-                question = await self._get_question_by_id(question_id)
-                if question:
-                    recommendations.append(QuestionRecommendation(
-                        question_id=question_id,
-                        question=question,
-                        score=relevance * self.algorithm_weights["knowledge_graph"],
-                        reason="针对薄弱知识点的定向推荐",
-                        confidence=0.85,
-                        recommendation_type="knowledge_graph"
-                    ))
-            
-            logger.debug(f"知识图谱推荐 {len(recommendations)} 道题目")
-            return recommendations
+            candidates = self._candidate_arrays(related_questions[:request.num_questions * 2])
+            
+            self.log.debug("知识图谱推荐候选", count=len(candidates[0]))
+            return candidates
             
         except Exception as e:
-            logger.error(f"知识图谱推荐失败: {e}")
-            return []
+            self.log.error("知识图谱推荐失败", error=str(e))
+            return EMPTY_CANDIDATES
     
     async def _user_preference_recommend(
         self,
         request: RecommendationRequest,
         user_profile: UserProfile
-    ) -> List[QuestionRecommendation]:
-        """基于用户偏好的推荐"""
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """基于用户偏好的推荐，返回候选题目ID及匹配度"""
         try:
             # 根据用户偏好设置筛选题目
             preference_filters = self._build_preference_filters(user_profile)
@@ -333,128 +772,220 @@ class QuestionRecommendAgent(AssistantAgent):
                 preference_filters, request
             )
             
-            recommendations = []
-            for question_id, match_score in matching_questions[:request.num_questions * 2]:
-                question = await self._get_question_by_id(question_id)
-                if question:
-                    recommendations.append(QuestionRecommendation(
-                        question_id=question_id,
-                        question=question,
-                        score=match_score * self.algorithm_weights["user_preference"],
-                        reason="基于个人学习偏好推荐",
-                        confidence=0.7,
-                        recommendation_type="user_preference"
-                    ))
-            
-            logger.debug(f"用户偏好推荐 {len(recommendations)} 道题目")
-            return recommendations
+            candidates = self._candidate_arrays(matching_questions[:request.num_questions * 2])
+            
+            self.log.debug("用户偏好推荐候选", count=len(candidates[0]))
+            return candidates
             
         except Exception as e:
-            logger.error(f"用户偏好推荐失败: {e}")
-            return []
+            self.log.error("用户偏好推荐失败", error=str(e))
+            return EMPTY_CANDIDATES
     
     async def _post_process_recommendations(
         self,
-        recommendations: List[QuestionRecommendation],
+        columns: RecommendationColumns,
+        questions: Dict[str, Question],
         request: RecommendationRequest,
         user_profile: UserProfile
     ) -> List[QuestionRecommendation]:
         """后处理推荐结果"""
         
-        # 1. 去重（基于question_id）
-        unique_recommendations = {}
-        for rec in recommendations:
-            if rec.question_id not in unique_recommendations:
-                unique_recommendations[rec.question_id] = rec
-            else:
-                # 如果重复，选择分数更高的
-                if rec.score > unique_recommendations[rec.question_id].score:
-                    unique_recommendations[rec.question_id] = rec
-        
-        recommendations = list(unique_recommendations.values())
-        
-        # 2. 按分数排序
-        recommendations.sort(key=lambda x: x.score, reverse=True)
+        # 1. 去重（重复时保留分数更高的）并按分数排序
+        columns = columns.take(self._dedup_by_best_score(columns))
         
-        # 3. 多样性优化
-        recommendations = await self._optimize_diversity(recommendations, request)
+        # 2. 多样性优化，只为最终入选的题目构建推荐对象
+        columns = await self._optimize_diversity(columns, questions, request)
+        recommendations = columns.to_recommendations(questions)
         
-        # 4. 应用业务规则过滤
+        # 3. 应用业务规则过滤
         recommendations = await self._apply_business_filters(recommendations, request, user_profile)
         
         return recommendations
     
+    @staticmethod
+    def _dedup_by_best_score(columns: RecommendationColumns) -> np.ndarray:
+        """
+        返回每个题目分数最高的那条记录的下标，按分数降序排列
+
+        同一题目分数相同时保留最先出现的记录；不同题目分数相同时
+        按题目首次出现的先后排列。
+        """
+        if len(columns) == 0:
+            return np.empty(0, dtype=np.intp)
+        
+        positions = np.arange(len(columns))
+        # 转为定长字符串数组，np.unique在C层比较而不是逐个调用Python对象比较
+        _, first_seen, group = np.unique(
+            columns.question_ids.astype(str), return_index=True, return_inverse=True
+        )
+        # 按 (题目, 分数降序, 出现位置) 排序，每组第一条即该题目的最佳记录
+        order = np.lexsort((positions, -columns.scores, group))
+        grouped = group[order]
+        best = order[np.concatenate(([True], grouped[1:] != grouped[:-1]))]
+        # best与first_seen都按题目分组顺序排列，再按 (分数降序, 首次出现位置) 排序
+        return best[np.lexsort((first_seen, -columns.scores[best]))]
+    
     async def _optimize_diversity(
         self,
-        recommendations: List[QuestionRecommendation],
+        columns: RecommendationColumns,
+        questions: Dict[str, Question],
         request: RecommendationRequest
-    ) -> List[QuestionRecommendation]:
-        """优化推荐结果的多样性"""
-        if len(recommendations) <= request.num_questions:
-            return recommendations
+    ) -> RecommendationColumns:
+        """优化推荐结果的多样性（输入已按分数降序排列）"""
+        # 候选只比需要的略多时多样性收益可以忽略，直接取分数最高的
+        if len(columns) <= request.num_questions * 1.1:
+            return columns.take(np.arange(min(len(columns), request.num_questions)))
         
-        # 使用最大边际相关性(MMR)算法优化多样性
-        selected = []
-        remaining = recommendations.copy()
+        try:
+            features = self._build_candidate_feature_matrix(
+                [questions[question_id] for question_id in columns.question_ids]
+            )
+        except Exception as e:
+            self.log.warning("构建候选特征矩阵失败，使用逐对计算", error=str(e))
+            return RecommendationColumns.from_recommendations(
+                self._optimize_diversity_fallback(columns.to_recommendations(questions), request)
+            )
         
-        # 选择得分最高的作为第一个
-        if remaining:
-            selected.append(remaining.pop(0))
+        # 一次性计算所有候选之间的余弦相似度
+        norms = np.linalg.norm(features, axis=1)
+        norms[norms == 0] = 1.0
+        normalized = features / norms[:, None]
         
-        # 基于多样性选择后续题目
-        while len(selected) < request.num_questions and remaining:
-            best_candidate = None
-            best_score = -1
-            
-            for candidate in remaining:
-                # 计算与已选题目的多样性
-                diversity_score = await self._calculate_diversity_score(candidate, selected)
-                
-                # 结合原始分数和多样性分数
-                combined_score = 0.7 * candidate.score + 0.3 * diversity_score
-                
-                if combined_score > best_score:
-                    best_score = combined_score
-                    best_candidate = candidate
+        # 候选较多时先聚类再从每个簇取最高分，代替逐步MMR；聚类在线程池中执行，不阻塞事件循环
+        if len(columns) >= settings.diversity_cluster_min_candidates:
+            selected = await asyncio.to_thread(self._select_by_clusters, normalized, request.num_questions)
+            return columns.take(selected)
+        
+        similarities = np.dot(normalized, normalized.T)
+        
+        scores = columns.scores
+        
+        # 使用最大边际相关性(MMR)算法优化多样性：先选得分最高的题目
+        selected_idx = [int(np.argmax(scores))]
+        selected_mask = np.zeros(len(columns), dtype=bool)
+        selected_mask[selected_idx[0]] = True
+        # 各候选与已选题目的最大相似度，每选一题增量更新，单步O(N)
+        max_similarity = similarities[selected_idx[0]].copy()
+        mmr = np.empty_like(scores)
+        
+        num_selected = min(request.num_questions, len(columns))
+        while len(selected_idx) < num_selected:
+            # 结合原始分数和与已选题目的最大相似度
+            np.multiply(max_similarity, -0.3, out=mmr)
+            mmr += 0.7 * scores
+            mmr[selected_mask] = -np.inf
             
-            if best_candidate:
-                selected.append(best_candidate)
-                remaining.remove(best_candidate)
+            pick = int(np.argmax(mmr))
+            selected_idx.append(pick)
+            selected_mask[pick] = True
+            np.maximum(max_similarity, similarities[pick], out=max_similarity)
         
+        return columns.take(np.asarray(selected_idx))
+    
+    @staticmethod
+    def _select_by_clusters(features: np.ndarray, num_selected: int) -> np.ndarray:
+        """对候选特征做k-means聚类，每个簇选分数最高的一题，簇数不足时按分数补齐"""
+        labels = KMeans(n_clusters=num_selected, n_init=1, random_state=0).fit_predict(features)
+        
+        # 候选按分数降序排列，每个簇的首次出现即簇内最高分
+        _, first_idx = np.unique(labels, return_index=True)
+        selected = np.sort(first_idx)
+        if len(selected) < num_selected:
+            remaining = np.setdiff1d(np.arange(len(features)), selected, assume_unique=True)
+            selected = np.sort(np.concatenate([selected, remaining[:num_selected - len(selected)]]))
         return selected
     
-    async def _calculate_diversity_score(
-        self, 
-        candidate: QuestionRecommendation,
-        selected: List[QuestionRecommendation]
-    ) -> float:
-        """计算题目多样性分数"""
-        if not selected:
-            return 1.0
-        
-        # 基于知识点、难度、题型等维度计算多样性
-        diversity_scores = []
-        
-        for selected_item in selected:
-            # 知识点多样性
-            knowledge_diversity = await self._calculate_knowledge_diversity(
-                candidate.question, selected_item.question
-            )
-            
-            # 难度多样性
-            difficulty_diversity = abs(
-                candidate.question.difficulty_level - selected_item.question.difficulty_level
-            ) / 5.0
-            
-            # 题型多样性
-            type_diversity = 1.0 if candidate.question.question_type != selected_item.question.question_type else 0.0
+    def _build_candidate_feature_matrix(self, questions: List[Question]) -> np.ndarray:
+        """
+        构建候选题目特征矩阵
+        
+        每行对应一道候选题目，列依次为：知识点one-hot、难度（归一化）、题型one-hot
+        """
+        knowledge_index: Dict[str, int] = {}
+        type_index: Dict[Any, int] = {}
+        for question in questions:
+            for knowledge_point in question.knowledge_points:
+                knowledge_index.setdefault(knowledge_point, len(knowledge_index))
+            type_index.setdefault(question.question_type, len(type_index))
+        
+        difficulty_col = len(knowledge_index)
+        type_offset = difficulty_col + 1
+        features = np.zeros(
+            (len(questions), type_offset + len(type_index)), dtype=np.float32
+        )
+        
+        for row, question in enumerate(questions):
+            for knowledge_point in question.knowledge_points:
+                features[row, knowledge_index[knowledge_point]] = 1.0
+            features[row, difficulty_col] = question.difficulty_level / 5.0
+            features[row, type_offset + type_index[question.question_type]] = 1.0
+        
+        return features
+    
+    def _optimize_diversity_fallback(
+        self,
+        recommendations: List[QuestionRecommendation],
+        request: RecommendationRequest
+    ) -> List[QuestionRecommendation]:
+        """逐对计算多样性的MMR实现，仅在无法构建特征矩阵时使用"""
+        count = len(recommendations)
+        questions = [rec.question for rec in recommendations]
+        scores = np.fromiter((rec.score for rec in recommendations), dtype=np.float32, count=count)
+        
+        # 难度和题型编码为int8列，多样性按列计算
+        type_codes: Dict[Any, int] = {}
+        difficulty_levels = np.fromiter(
+            (question.difficulty_level for question in questions), dtype=np.int8, count=count
+        )
+        question_types = np.fromiter(
+            (type_codes.setdefault(question.question_type, len(type_codes)) for question in questions),
+            dtype=np.int8, count=count
+        )
+        
+        selected_idx = [0]
+        selected_mask = np.zeros(count, dtype=bool)
+        selected_mask[0] = True
+        # 各候选与已选题目的多样性分数之和，每选一题累加一次
+        diversity_sum = self._calculate_diversity_scores(questions, difficulty_levels, question_types, 0)
+        
+        num_selected = min(request.num_questions, count)
+        while len(selected_idx) < num_selected:
+            combined = 0.7 * scores + 0.3 * diversity_sum / len(selected_idx)
+            combined[selected_mask] = -np.inf
             
-            # 综合多样性分数
-            diversity = (knowledge_diversity + difficulty_diversity + type_diversity) / 3.0
-            diversity_scores.append(diversity)
+            pick = int(np.argmax(combined))
+            selected_idx.append(pick)
+            selected_mask[pick] = True
+            diversity_sum += self._calculate_diversity_scores(
+                questions, difficulty_levels, question_types, pick
+            )
         
-        # 返回平均多样性分数
-        return sum(diversity_scores) / len(diversity_scores)
+        return [recommendations[i] for i in selected_idx]
+    
+    def _calculate_diversity_scores(
+        self,
+        questions: List[Question],
+        difficulty_levels: np.ndarray,
+        question_types: np.ndarray,
+        selected: int
+    ) -> np.ndarray:
+        """计算所有候选题目与一道已选题目之间的多样性分数（知识点、难度、题型三个维度的均值）"""
+        selected_question = questions[selected]
+        knowledge_diversity = np.fromiter(
+            (self._calculate_knowledge_diversity(question, selected_question) for question in questions),
+            dtype=np.float32, count=len(questions)
+        )
+        difficulty_diversity = np.abs(difficulty_levels - difficulty_levels[selected]) / 5.0
+        type_diversity = (question_types != question_types[selected]).astype(np.float32)
+        return (knowledge_diversity + difficulty_diversity + type_diversity) / 3.0
+    
+    def _calculate_knowledge_diversity(self, question_a: Question, question_b: Question) -> float:
+        """计算两道题目知识点的差异度（1 - Jaccard相似度）"""
+        points_a = set(question_a.knowledge_points)
+        points_b = set(question_b.knowledge_points)
+        if not points_a and not points_b:
+            return 0.0
+        return 1.0 - len(points_a & points_b) / len(points_a | points_b)
     
     async def _recommend_for_new_user(
         self, 
@@ -462,7 +993,7 @@ class QuestionRecommendAgent(AssistantAgent):
     ) -> List[QuestionRecommendation]:
         """新用户推荐策略"""
         try:
-            logger.info(f"🆕 为新用户推荐题目")
+            self.log.info("🆕 为新用户推荐题目", user_id=request.user_id)
             
             # 推荐热门和高质量的入门题目
             query = """
@@ -495,7 +1026,7 @@ class QuestionRecommendAgent(AssistantAgent):
             return recommendations
             
         except Exception as e:
-            logger.error(f"新用户推荐失败: {e}")
+            self.log.error("新用户推荐失败", error=str(e))
             return []
     
     async def _fallback_recommendation(
@@ -505,7 +1036,7 @@ class QuestionRecommendAgent(AssistantAgent):
     ) -> List[QuestionRecommendation]:
         """降级推荐策略"""
         try:
-            logger.warning(f"⚠️ 使用降级推荐策略")
+            self.log.warning("⚠️ 使用降级推荐策略", user_id=user_id)
             
             # 返回最近更新的高质量题目
             query = """
@@ -533,7 +1064,7 @@ class QuestionRecommendAgent(AssistantAgent):
             return recommendations
             
         except Exception as e:
-            logger.error(f"降级推荐失败: {e}")
+            self.log.error("降级推荐失败", error=str(e))
             return []
     
     async def update_recommendation_feedback(
@@ -557,18 +1088,18 @@ class QuestionRecommendAgent(AssistantAgent):
             # 存储到数据库
             await self.db_service.insert_recommendation_feedback(feedback_data)
             
-            # 清除相关缓存
-            if user_id in self.recommendation_cache:
-                del self.recommendation_cache[user_id]
+            # 清除相关缓存（Redis中的共享缓存主动删除，其他Worker的L1随短TTL过期）
+            self.recommendation_cache.pop(user_id, None)
+            await self.shared_cache.invalidate(user_id)
                 
-            logger.info(f"📝 记录推荐反馈: user={user_id}, question={question_id}")
+            self.log.info("📝 记录推荐反馈", user_id=user_id, question_id=question_id)
             
         except Exception as e:
-            logger.error(f"记录推荐反馈失败: {e}")
+            self.log.error("记录推荐反馈失败", error=str(e))
     
     async def cleanup(self):
         """清理资源"""
         self.recommendation_cache.clear()
-        self.last_cache_update.clear()
+        await self.shared_cache.close()
         await self.db_service.close()
         await self.vector_service.close()
\ No newline at end of file
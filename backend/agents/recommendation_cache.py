@@ -0,0 +1,97 @@
+"""
+推荐结果二级缓存 - 基于Redis，多个Worker进程共享，反馈时主动失效
+"""
+from typing import Optional
+
+import redis.asyncio as redis
+import structlog
+
+
+logger = structlog.get_logger(__name__)
+
+
+class RedisRecommendationCache:
+    """
+    Redis推荐结果缓存
+
+    键格式为 recommendations:{user_id}:{num_questions_bucket}，值为
+    调用方序列化好的字节串；每个用户已写入的键记录在集合
+    recommendations:{user_id}:keys 中，失效时直接删除，不需要扫描键空间。
+    Redis不可用时读写均静默降级为未命中。
+    """
+
+    KEY_PREFIX = "recommendations"
+    SIMILAR_USERS_PREFIX = "similar_users"
+
+    def __init__(self, redis_url: str, ttl: int = 3600):
+        self.ttl = ttl
+        self._redis = redis.from_url(redis_url)
+
+    @staticmethod
+    def bucket(num_questions: int) -> int:
+        """将推荐数量向上取整到10的倍数，相近的请求共用同一个键"""
+        return max(10, -(-num_questions // 10) * 10)
+
+    def _key(self, user_id: str, num_questions: int) -> str:
+        return f"{self.KEY_PREFIX}:{user_id}:{self.bucket(num_questions)}"
+
+    def _index_key(self, user_id: str) -> str:
+        return f"{self.KEY_PREFIX}:{user_id}:keys"
+
+    async def get(self, user_id: str, num_questions: int) -> Optional[bytes]:
+        """读取缓存，未命中或Redis异常返回None"""
+        try:
+            return await self._redis.get(self._key(user_id, num_questions))
+        except redis.RedisError as e:
+            logger.warning("推荐缓存读取失败", user_id=user_id, error=str(e))
+            return None
+
+    async def set(self, user_id: str, num_questions: int, payload: bytes):
+        """写入缓存并设置过期时间，同时登记到用户的键集合"""
+        key = self._key(user_id, num_questions)
+        index_key = self._index_key(user_id)
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.set(key, payload, ex=self.ttl)
+                pipe.sadd(index_key, key)
+                pipe.expire(index_key, self.ttl)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("推荐缓存写入失败", user_id=user_id, error=str(e))
+
+    async def invalidate(self, user_id: str) -> int:
+        """删除用户所有数量分桶下的缓存，返回删除的键数（不含键集合本身）"""
+        index_key = self._index_key(user_id)
+        try:
+            keys = await self._redis.smembers(index_key)
+            deleted = await self._redis.delete(index_key, *keys)
+            return max(deleted - 1, 0)
+        except redis.RedisError as e:
+            logger.warning("推荐缓存失效失败", user_id=user_id, error=str(e))
+            return 0
+
+    async def get_similar_users(self, user_id: str) -> Optional[bytes]:
+        """读取预计算的相似用户列表"""
+        try:
+            return await self._redis.get(f"{self.SIMILAR_USERS_PREFIX}:{user_id}")
+        except redis.RedisError as e:
+            logger.warning("相似用户缓存读取失败", user_id=user_id, error=str(e))
+            return None
+
+    async def set_similar_users(self, user_id: str, payload: bytes, ttl: int):
+        """写入相似用户列表"""
+        try:
+            await self._redis.set(f"{self.SIMILAR_USERS_PREFIX}:{user_id}", payload, ex=ttl)
+        except redis.RedisError as e:
+            logger.warning("相似用户缓存写入失败", user_id=user_id, error=str(e))
+
+    async def invalidate_similar_users(self, user_id: str):
+        """用户画像变化时删除其相似用户列表"""
+        try:
+            await self._redis.delete(f"{self.SIMILAR_USERS_PREFIX}:{user_id}")
+        except redis.RedisError as e:
+            logger.warning("相似用户缓存失效失败", user_id=user_id, error=str(e))
+
+    async def close(self):
+        """关闭Redis连接池"""
+        await self._redis.aclose()
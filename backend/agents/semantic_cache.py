@@ -0,0 +1,186 @@
+"""
+语义缓存 - 复用相似请求的LLM响应结果
+"""
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import structlog
+from cachetools import TTLCache
+from sentence_transformers import SentenceTransformer
+
+
+logger = structlog.get_logger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    """语义缓存条目"""
+    namespace: Tuple[Hashable, ...]
+    embedding: np.ndarray
+    value: Any
+    expires_at: float
+    hits: int = 0
+
+
+class SemanticCache:
+    """
+    语义缓存
+
+    以请求文本的向量表示为键，余弦相似度达到阈值即视为命中。
+    新条目进入LRU淘汰的短期区(MTM)，命中次数达到阈值后晋升到
+    LFU淘汰的长期区(LTM)。两个分区的条目按命名空间堆叠成矩阵，
+    查询时一次矩阵乘法完成比较。
+    向量传入None时按命名空间精确匹配，用于以ID为键、不能按相似度复用的请求。
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        threshold: float = 0.87,
+        ttl: int = 3600,
+        mtm_size: int = 1024,
+        ltm_size: int = 256,
+        promote_hits: int = 3
+    ):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.mtm_size = mtm_size
+        self.ltm_size = ltm_size
+        self.promote_hits = promote_hits
+
+        self._model: Optional[SentenceTransformer] = None
+        self._mtm: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._ltm: Dict[int, CacheEntry] = {}
+        self._ids = itertools.count()
+        # 命名空间 -> 条目，以及按命名空间堆叠好的向量矩阵（条目变化时失效）
+        self._by_namespace: Dict[Tuple[Hashable, ...], Dict[int, CacheEntry]] = {}
+        self._indexes: Dict[Tuple[Hashable, ...], Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._exact: "TTLCache[Tuple[Hashable, ...], Any]" = TTLCache(maxsize=mtm_size, ttl=ttl)
+
+    async def load(self):
+        """加载向量模型（只在启动时执行一次）"""
+        if self._model is None:
+            self._model = await asyncio.to_thread(SentenceTransformer, self.model_name)
+            logger.info("语义缓存模型加载完成", model=self.model_name)
+
+    async def embed(self, text: str) -> np.ndarray:
+        """计算归一化后的文本向量"""
+        if self._model is None:
+            raise RuntimeError("语义缓存模型未加载")
+        embedding = await asyncio.to_thread(
+            self._model.encode, text, normalize_embeddings=True
+        )
+        return np.asarray(embedding, dtype=np.float32)
+
+    async def embed_many(self, texts: List[str]) -> np.ndarray:
+        """批量计算归一化后的文本向量，一次模型调用完成"""
+        if self._model is None:
+            raise RuntimeError("语义缓存模型未加载")
+        embeddings = await asyncio.to_thread(
+            self._model.encode, texts, normalize_embeddings=True
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def get(self, namespace: Tuple[Hashable, ...], embedding: Optional[np.ndarray]) -> Optional[Any]:
+        """查询与向量最相似的缓存结果，未命中返回None"""
+        if embedding is None:
+            return self._exact.get(namespace)
+
+        index = self._namespace_index(namespace)
+        if index is None:
+            return None
+
+        # 同一命名空间的全部条目一次矩阵乘法算出相似度
+        entry_ids, matrix, expires_at = index
+        similarities = matrix @ embedding
+        expired = expires_at <= time.monotonic()
+        if expired.any():
+            for entry_id in entry_ids[expired].tolist():
+                self._remove(entry_id)
+            similarities[expired] = -np.inf
+
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        best_id = int(entry_ids[best])
+        if best_id in self._mtm:
+            entry = self._mtm[best_id]
+            entry.hits += 1
+            self._mtm.move_to_end(best_id)
+            if entry.hits >= self.promote_hits:
+                self._promote(best_id)
+        else:
+            entry = self._ltm[best_id]
+            entry.hits += 1
+
+        return entry.value
+
+    def put(self, namespace: Tuple[Hashable, ...], embedding: Optional[np.ndarray], value: Any):
+        """写入缓存结果"""
+        if embedding is None:
+            self._exact[namespace] = value
+            return
+
+        entry_id = next(self._ids)
+        entry = CacheEntry(
+            namespace=namespace,
+            embedding=embedding,
+            value=value,
+            expires_at=time.monotonic() + self.ttl
+        )
+        self._mtm[entry_id] = entry
+        self._by_namespace.setdefault(namespace, {})[entry_id] = entry
+        self._indexes.pop(namespace, None)
+
+        while len(self._mtm) > self.mtm_size:
+            self._remove(next(iter(self._mtm)))
+
+    def clear(self):
+        """清空缓存"""
+        self._mtm.clear()
+        self._ltm.clear()
+        self._by_namespace.clear()
+        self._indexes.clear()
+        self._exact.clear()
+
+    def _namespace_index(
+        self, namespace: Tuple[Hashable, ...]
+    ) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """返回命名空间的 (条目ID, 向量矩阵, 过期时间)，条目变化后首次查询时重建"""
+        index = self._indexes.get(namespace)
+        if index is not None:
+            return index
+
+        entries = self._by_namespace.get(namespace)
+        if not entries:
+            return None
+
+        index = (
+            np.fromiter(entries.keys(), dtype=np.int64, count=len(entries)),
+            np.stack([entry.embedding for entry in entries.values()]),
+            np.fromiter((entry.expires_at for entry in entries.values()), dtype=np.float64, count=len(entries))
+        )
+        self._indexes[namespace] = index
+        return index
+
+    def _remove(self, entry_id: int):
+        """从所在分区和命名空间索引中删除条目"""
+        entry = self._mtm.pop(entry_id, None) or self._ltm.pop(entry_id)
+        entries = self._by_namespace[entry.namespace]
+        del entries[entry_id]
+        if not entries:
+            del self._by_namespace[entry.namespace]
+        self._indexes.pop(entry.namespace, None)
+
+    def _promote(self, entry_id: int):
+        """将热点条目从短期区晋升到长期区"""
+        if len(self._ltm) >= self.ltm_size:
+            self._remove(min(self._ltm, key=lambda k: self._ltm[k].hits))
+        self._ltm[entry_id] = self._mtm.pop(entry_id)
@@ -0,0 +1,99 @@
+"""
+Agent任务结果存储 - 容量有界、带过期时间的LRU存储
+"""
+import heapq
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# 终态：任务不会再更新，记录才参与过期和淘汰
+TERMINAL_STATUSES = frozenset({"completed", "failed", "rejected"})
+
+
+@dataclass
+class TaskRecord:
+    """任务状态记录"""
+    status: str
+    result: Any = None
+    error: Optional[str] = None
+    finished_at: Optional[float] = None
+    expires_at: float = 0.0
+
+
+class TaskStore:
+    """
+    任务结果存储
+
+    未结束（pending/running）的任务单独保存，不过期也不淘汰，
+    避免排队中的任务丢失记录。进入终态的记录超出容量时淘汰
+    最久未写入的一条；过期时间按进入终态的时刻计算，由最小堆
+    按到期顺序清理。
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: int = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._active: Dict[str, TaskRecord] = {}
+        self._records: "OrderedDict[str, TaskRecord]" = OrderedDict()
+        self._expiry_heap: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._active) + len(self._records)
+
+    def put(self, task_id: str, record: TaskRecord):
+        """写入或覆盖任务记录"""
+        if record.status not in TERMINAL_STATUSES:
+            self._records.pop(task_id, None)
+            self._active[task_id] = record
+            return
+
+        self._active.pop(task_id, None)
+        record.expires_at = time.monotonic() + self.ttl
+        self._records[task_id] = record
+        self._records.move_to_end(task_id)
+        heapq.heappush(self._expiry_heap, (record.expires_at, task_id))
+
+        while len(self._records) > self.maxsize:
+            self._records.popitem(last=False)
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        """读取任务记录，已过期返回None"""
+        record = self._active.get(task_id)
+        if record is not None:
+            return record
+
+        record = self._records.get(task_id)
+        if record is None:
+            return None
+        if record.expires_at <= time.monotonic():
+            del self._records[task_id]
+            return None
+        return record
+
+    def purge_expired(self) -> int:
+        """清理所有已过期的记录，返回清理数量"""
+        now = time.monotonic()
+        purged = 0
+
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, task_id = heapq.heappop(self._expiry_heap)
+            record = self._records.get(task_id)
+            # 记录被重写过时堆中是旧的到期时间，跳过
+            if record is not None and record.expires_at == expires_at:
+                del self._records[task_id]
+                purged += 1
+
+        # 被LRU淘汰的记录会在堆中残留，数量过多时重建
+        if len(self._expiry_heap) > 2 * self.maxsize:
+            self._expiry_heap = [(r.expires_at, k) for k, r in self._records.items()]
+            heapq.heapify(self._expiry_heap)
+
+        return purged
+
+    def clear(self):
+        """清空存储"""
+        self._active.clear()
+        self._records.clear()
+        self._expiry_heap.clear()
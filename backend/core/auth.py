@@ -1,73 +1,99 @@
 """
 用户认证和授权模块
 """
-from datetime import datetime, timedelta
+import asyncio
+import functools
+import json
+import time
+from datetime import timedelta
 from typing import Optional, Dict, Any
+import bcrypt
 import jwt
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, Request, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from passlib.context import CryptContext
+from starlette.types import ASGIApp, Receive, Scope, Send
 from core.config import settings
 import structlog
 
 logger = structlog.get_logger(__name__)
 
-# 密码加密上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # JWT Bearer scheme
 security = HTTPBearer()
 
+# 签名算法对象和密钥在导入时预先构建，解码时直接复用
+_JWT_ALGORITHM = jwt.algorithms.get_default_algorithms()[settings.jwt_algorithm]
+_JWT_KEY = _JWT_ALGORITHM.prepare_key(settings.jwt_secret_key)
+
+# 令牌头部对固定算法是常量，base64url编码后的头部段只计算一次
+_JWT_HEADER_SEGMENT = jwt.utils.base64url_encode(
+    json.dumps({"alg": settings.jwt_algorithm, "typ": "JWT"}, separators=(",", ":")).encode()
+)
+
+# 令牌有效期（秒），iat/exp 直接使用整数时间戳
+_ACCESS_TOKEN_TTL_SECONDS = settings.jwt_access_token_expire_minutes * 60
+_REFRESH_TOKEN_TTL_SECONDS = 7 * 24 * 3600  # 7天有效期
+
+
+def _encode_token(payload: Dict[str, Any]) -> str:
+    """使用预编码的头部段和预处理的密钥签发令牌"""
+    payload_segment = jwt.utils.base64url_encode(
+        json.dumps(payload, separators=(",", ":")).encode()
+    )
+    signing_input = _JWT_HEADER_SEGMENT + b"." + payload_segment
+    signature = _JWT_ALGORITHM.sign(signing_input, _JWT_KEY)
+    return (signing_input + b"." + jwt.utils.base64url_encode(signature)).decode()
+
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """创建JWT访问令牌"""
     to_encode = data.copy()
+    now = int(time.time())
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        ttl = int(expires_delta.total_seconds())
     else:
-        expire = datetime.utcnow() + timedelta(minutes=settings.jwt_access_token_expire_minutes)
+        ttl = _ACCESS_TOKEN_TTL_SECONDS
     
     to_encode.update({
-        "exp": expire,
-        "iat": datetime.utcnow(),
+        "exp": now + ttl,
+        "iat": now,
         "type": "access_token"
     })
     
-    encoded_jwt = jwt.encode(
-        to_encode, 
-        settings.jwt_secret_key, 
-        algorithm=settings.jwt_algorithm
-    )
-    return encoded_jwt
+    return _encode_token(to_encode)
 
 
 def create_refresh_token(data: Dict[str, Any]) -> str:
     """创建刷新令牌"""
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(days=7)  # 7天有效期
+    now = int(time.time())
     
     to_encode.update({
-        "exp": expire,
-        "iat": datetime.utcnow(),
+        "exp": now + _REFRESH_TOKEN_TTL_SECONDS,
+        "iat": now,
         "type": "refresh_token"
     })
     
-    encoded_jwt = jwt.encode(
-        to_encode,
-        settings.jwt_secret_key,
-        algorithm=settings.jwt_algorithm
-    )
-    return encoded_jwt
+    return _encode_token(to_encode)
+
+
+@functools.lru_cache(maxsize=4096)
+def _decode_token_cached(token: str) -> Dict[str, Any]:
+    """解码并校验签名，同一令牌的结果在进程内缓存（访问令牌有效期短，缓存自然有界）"""
+    return jwt.decode(token, _JWT_KEY, algorithms=[settings.jwt_algorithm])
+
+
+def _decode_token(token: str) -> Dict[str, Any]:
+    """解码令牌，缓存命中时跳过签名校验，但每次都检查过期时间"""
+    payload = _decode_token_cached(token)
+    if payload.get("exp", float("inf")) <= time.time():
+        raise jwt.ExpiredSignatureError("Signature has expired")
+    return dict(payload)
 
 
 def verify_token(token: str) -> Dict[str, Any]:
     """验证JWT令牌"""
     try:
-        payload = jwt.decode(
-            token,
-            settings.jwt_secret_key,
-            algorithms=[settings.jwt_algorithm]
-        )
+        payload = _decode_token(token)
         
         # 检查令牌类型
         if payload.get("type") != "access_token":
@@ -95,19 +121,31 @@ def verify_token(token: str) -> Dict[str, Any]:
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """验证密码"""
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+    except ValueError:
+        # 哈希格式非法
+        return False
 
 
 def get_password_hash(password: str) -> str:
     """获取密码哈希"""
-    return pwd_context.hash(password)
+    salt = bcrypt.gensalt(rounds=settings.bcrypt_rounds)
+    return bcrypt.hashpw(password.encode(), salt).decode()
 
 
-async def get_current_user_from_token(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-) -> Dict[str, Any]:
-    """从JWT令牌中获取当前用户信息"""
-    token = credentials.credentials
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """在线程池中验证密码，避免阻塞事件循环"""
+    return await asyncio.to_thread(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """在线程池中计算密码哈希，避免阻塞事件循环"""
+    return await asyncio.to_thread(get_password_hash, password)
+
+
+def _resolve_user(token: str) -> Dict[str, Any]:
+    """校验访问令牌并提取用户信息"""
     payload = verify_token(token)
     
     user_id = payload.get("user_id")
@@ -125,6 +163,59 @@ async def get_current_user_from_token(
     }
 
 
+class AuthMiddleware:
+    """
+    认证中间件
+    
+    对API前缀下携带Bearer令牌的请求解码一次令牌，结果写入 request.state.user，
+    校验失败时写入 request.state.auth_error。中间件本身不拒绝请求，是否需要
+    登录仍由各路由的 get_current_user_from_token 依赖决定。
+    """
+    
+    def __init__(self, app: ASGIApp, path_prefix: str):
+        self.app = app
+        self.path_prefix = path_prefix.rstrip("/") + "/"
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["path"].startswith(self.path_prefix):
+            token = self._bearer_token(scope)
+            if token:
+                state = scope.setdefault("state", {})
+                try:
+                    state["user"] = _resolve_user(token)
+                except HTTPException as e:
+                    state["auth_error"] = e
+        
+        await self.app(scope, receive, send)
+    
+    @staticmethod
+    def _bearer_token(scope: Scope) -> Optional[str]:
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    return token
+                return None
+        return None
+
+
+async def get_current_user_from_token(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Dict[str, Any]:
+    """从JWT令牌中获取当前用户信息，优先复用认证中间件的解码结果"""
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
+    
+    auth_error = getattr(request.state, "auth_error", None)
+    if auth_error is not None:
+        raise auth_error
+    
+    # 未经过认证中间件的路径
+    return _resolve_user(credentials.credentials)
+
+
 class AuthManager:
     """认证管理器"""
     
@@ -146,7 +237,7 @@ class AuthManager:
         try:
             payload = jwt.decode(
                 refresh_token,
-                settings.jwt_secret_key,
+                _JWT_KEY,
                 algorithms=[settings.jwt_algorithm]
             )
             
@@ -157,14 +248,15 @@ class AuthManager:
                     detail="无效的刷新令牌"
                 )
             
-            # 创建新的访问令牌
-            user_data = {
-                "user_id": payload.get("user_id"),
-                "openid": payload.get("openid"),
-                "role": payload.get("role")
-            }
+            # 直接复用已解析的声明，只替换类型和时间戳
+            now = int(time.time())
+            payload.update({
+                "exp": now + _ACCESS_TOKEN_TTL_SECONDS,
+                "iat": now,
+                "type": "access_token"
+            })
             
-            return create_access_token(data=user_data)
+            return _encode_token(payload)
             
         except jwt.ExpiredSignatureError:
             raise HTTPException(
@@ -2,6 +2,7 @@
 AI驱动的软考学习系统 - 核心配置
 """
 import os
+from types import SimpleNamespace
 from typing import Optional, List
 from pydantic import BaseSettings, Field
 from functools import lru_cache
@@ -20,7 +21,19 @@ class Settings(BaseSettings):
     api_host: str = "0.0.0.0"
     api_port: int = 8000
     api_prefix: str = "/api/v1"
+    api_workers: int = 0  # Gunicorn Worker数，0表示按CPU核数
+    api_keepalive_timeout: int = 30
+    api_limit_concurrency: int = 1000
+    api_backlog: int = 2048
+    api_max_requests: int = 10000  # 处理指定请求数后重启Worker，释放碎片化内存
+    api_max_requests_jitter: int = 1000
+    health_cache_ttl: float = 5.0  # /health 结果缓存秒数
+    shutdown_drain_timeout: float = 5.0  # 关闭时等待处理中请求完成的最长秒数
+    validation_log_interval: float = 1.0  # 同一路由同类422错误的最小日志间隔秒数
     cors_origins: List[str] = ["*"]
+    cors_allow_methods: List[str] = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+    cors_allow_headers: List[str] = ["Authorization", "Content-Type"]
+    allowed_hosts: List[str] = []  # 为空时不启用Host校验
     
     # 数据库配置
     database_url: str = Field(
@@ -36,21 +49,35 @@ class Settings(BaseSettings):
         env="REDIS_URL"
     )
     redis_session_expire: int = 86400  # 24小时
+    response_cache_questions_ttl: int = 30  # 题目GET接口响应缓存秒数
+    response_cache_stale_ttl: int = 3600  # 过期后仍保留用于故障兜底的秒数
     
     # Qdrant向量数据库
     qdrant_host: str = Field(default="localhost", env="QDRANT_HOST")
     qdrant_port: int = Field(default=6333, env="QDRANT_PORT")
     qdrant_collection_name: str = "ruankao_knowledge"
+    user_profile_collection: str = "user_profiles_vec"
     
     # LLM API配置
     openai_api_key: Optional[str] = Field(default=None, env="OPENAI_API_KEY")
     openai_api_base: Optional[str] = Field(default=None, env="OPENAI_API_BASE")
     anthropic_api_key: Optional[str] = Field(default=None, env="ANTHROPIC_API_KEY")
+    openai_rpm: int = 500
     
     # AutoGen配置
     autogen_cache_seed: int = 42
     autogen_max_consecutive_auto_reply: int = 5
     autogen_human_input_mode: str = "NEVER"
+    enable_group_chat: bool = False
+    
+    # Agent任务配置
+    agent_worker_count: int = 8
+    agent_prepare_batch_size: int = 8
+    agent_queue_max: int = 1000
+    agent_task_store_size: int = 10000
+    agent_task_result_ttl: int = 300  # 5分钟
+    agent_task_purge_interval: int = 30
+    agent_shutdown_timeout: int = 30
     
     # JWT认证
     jwt_secret_key: str = Field(
@@ -59,6 +86,7 @@ class Settings(BaseSettings):
     )
     jwt_algorithm: str = "HS256"
     jwt_access_token_expire_minutes: int = 30
+    bcrypt_rounds: int = 12  # 测试/CI环境可降到10
     
     # 日志配置
     log_level: str = "INFO"
@@ -66,13 +94,29 @@ class Settings(BaseSettings):
     
     # 推荐系统配置
     recommendation_batch_size: int = 100
-    recommendation_cache_ttl: int = 3600  # 1小时
+    recommendation_cache_ttl: int = 3600  # 1小时（Redis共享缓存）
+    recommendation_l1_cache_ttl: int = 60  # 进程内缓存
+    recommendation_l1_cache_size: int = 10000
+    similar_users_top_k: int = 20
+    similar_users_cache_ttl: int = 3600  # 1小时，画像更新时主动失效
+    question_corpus_check_interval: int = 300  # 题库版本检查间隔（秒）
+    question_corpus_n_features: int = 2 ** 18  # 题目文本哈希特征维度
+    question_cache_size: int = 50000
+    question_cache_ttl: int = 300  # 5分钟，题目修改时主动失效
+    diversity_cluster_min_candidates: int = 200  # 候选数达到该值时用聚类代替MMR
     
     # AI模型配置
     primary_llm_model: str = "gpt-4-turbo-preview"
     secondary_llm_model: str = "claude-3-sonnet-20240229"
     embedding_model: str = "text-embedding-3-small"
     
+    # 语义缓存配置
+    semantic_cache_enabled: bool = True
+    semantic_cache_model: str = "sentence-transformers/all-MiniLM-L6-v2"
+    semantic_cache_threshold: float = 0.87
+    semantic_cache_ttl: int = 3600  # 1小时
+    semantic_cache_size: int = 1024
+    
     # 业务规则配置
     max_questions_per_session: int = 50
     min_user_interactions_for_profile: int = 10
@@ -88,8 +132,20 @@ def get_settings() -> Settings:
     return Settings()
 
 
-# 预设配置实例
-settings = get_settings()
+class FrozenSettings(SimpleNamespace):
+    """只读的配置快照，属性读取与普通对象相同，不允许赋值或删除"""
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"settings是只读的，不能修改 {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"settings是只读的，不能删除 {name}")
+
+
+# 预设配置实例：启动时经Pydantic校验一次，之后冻结为只读属性对象，
+# 热路径上的读取不经过Pydantic。模块导入时已有多处按配置取值
+# （如JWT密钥、题目表容量、gunicorn参数），配置变更需重启进程生效
+settings = FrozenSettings(**get_settings().dict())
 
 
 # 开发环境专用配置
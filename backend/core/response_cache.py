@@ -0,0 +1,137 @@
+"""
+GET响应缓存中间件 - 基于Redis，白名单路径的响应字节直接复用
+"""
+import hashlib
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+
+import orjson
+import redis.asyncio as redis
+import structlog
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp
+
+
+logger = structlog.get_logger(__name__)
+
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    """
+    GET响应缓存
+
+    policies 为 {路径前缀: 新鲜期秒数}，只缓存命中前缀的GET请求的200响应。
+    缓存以Redis哈希存储（ts、stale_at、status、headers、body），新鲜期过后
+    再保留 stale_ttl 秒：处理函数抛出异常或返回5xx时，用过期条目兜底。
+    携带Authorization的请求按令牌摘要分开缓存，不同用户不会共用结果。
+    Redis客户端由应用创建并在关闭时释放，Redis不可用时直接执行处理函数。
+    """
+
+    KEY_PREFIX = "cache"
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        redis_client: redis.Redis,
+        policies: Dict[str, int],
+        stale_ttl: int = 3600
+    ):
+        super().__init__(app)
+        self._redis = redis_client
+        # 长前缀优先匹配
+        self.policies = sorted(policies.items(), key=lambda item: len(item[0]), reverse=True)
+        self.stale_ttl = stale_ttl
+
+    def _ttl_for(self, path: str) -> Optional[int]:
+        """返回路径对应的新鲜期，不在白名单内返回None"""
+        for prefix, ttl in self.policies:
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                return ttl
+        return None
+
+    def _key(self, request: Request) -> str:
+        """method + path + 排序后的查询串，带令牌时追加令牌摘要"""
+        query = urlencode(sorted(request.query_params.multi_items()))
+        key = f"{self.KEY_PREFIX}:{request.method}:{request.url.path}?{query}"
+        authorization = request.headers.get("authorization")
+        if authorization:
+            key += ":" + hashlib.sha256(authorization.encode()).hexdigest()[:16]
+        return key
+
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
+        ttl = self._ttl_for(request.url.path) if request.method == "GET" else None
+        if ttl is None:
+            return await call_next(request)
+
+        key = self._key(request)
+        entry = await self._load(key)
+        if entry is not None and time.time() < entry["stale_at"]:
+            return self._build_response(entry, "HIT")
+
+        try:
+            response = await call_next(request)
+        except Exception as e:
+            if entry is None:
+                raise
+            logger.warning("处理失败，返回过期缓存", path=request.url.path, error=str(e))
+            return self._build_response(entry, "STALE")
+
+        if response.status_code >= 500 and entry is not None:
+            logger.warning("处理返回5xx，返回过期缓存", path=request.url.path, status_code=response.status_code)
+            return self._build_response(entry, "STALE")
+        if response.status_code != 200 or "set-cookie" in response.headers:
+            return response
+
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        # content-length 由新响应按body重新计算
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+        entry = {
+            "ts": time.time(),
+            "stale_at": time.time() + ttl,
+            "status": response.status_code,
+            "headers": headers,
+            "body": body
+        }
+        await self._store(key, entry, ttl + self.stale_ttl)
+        return self._build_response(entry, "MISS")
+
+    async def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存条目，未命中或Redis异常返回None"""
+        try:
+            raw = await self._redis.hgetall(key)
+        except redis.RedisError as e:
+            logger.warning("响应缓存读取失败", key=key, error=str(e))
+            return None
+        if not raw:
+            return None
+        return {
+            "ts": float(raw[b"ts"]),
+            "stale_at": float(raw[b"stale_at"]),
+            "status": int(raw[b"status"]),
+            "headers": orjson.loads(raw[b"headers_json"]),
+            "body": raw[b"body"]
+        }
+
+    async def _store(self, key: str, entry: Dict[str, Any], expire: int):
+        """写入缓存条目，整体过期时间覆盖新鲜期和兜底期"""
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.hset(key, mapping={
+                    "ts": entry["ts"],
+                    "stale_at": entry["stale_at"],
+                    "status": entry["status"],
+                    "headers_json": orjson.dumps(entry["headers"]),
+                    "body": entry["body"]
+                })
+                pipe.expire(key, expire)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("响应缓存写入失败", key=key, error=str(e))
+
+    @staticmethod
+    def _build_response(entry: Dict[str, Any], cache_status: str) -> Response:
+        response = Response(content=entry["body"], status_code=entry["status"], headers=entry["headers"])
+        response.headers["X-Cache"] = cache_status
+        return response
@@ -0,0 +1,31 @@
+"""
+Gunicorn生产环境配置
+
+启动方式: gunicorn main:app -c gunicorn_conf.py
+每个Worker进程独立执行lifespan初始化（数据库、Redis、Agent系统）。
+"""
+import multiprocessing
+
+from uvicorn.workers import UvicornWorker
+
+from core.config import settings
+
+
+class LimitedUvicornWorker(UvicornWorker):
+    """限制单个Worker并发连接数的UvicornWorker（gunicorn的worker_connections对其不生效）"""
+    CONFIG_KWARGS = {
+        "loop": "auto",
+        "http": "auto",
+        "limit_concurrency": settings.api_limit_concurrency
+    }
+
+
+bind = f"{settings.api_host}:{settings.api_port}"
+workers = settings.api_workers or multiprocessing.cpu_count()
+worker_class = "gunicorn_conf.LimitedUvicornWorker"
+keepalive = settings.api_keepalive_timeout
+backlog = settings.api_backlog
+# 错开各Worker的重启时间，避免同时回收
+max_requests = settings.api_max_requests
+max_requests_jitter = settings.api_max_requests_jitter
+loglevel = settings.log_level.lower()
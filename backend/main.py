@@ -2,14 +2,19 @@
 AI驱动的软考学习系统 - FastAPI应用入口
 """
 import asyncio
+import logging
+import time
 from contextlib import asynccontextmanager
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel
+import orjson
+import redis.asyncio as redis
 import uvicorn
 import structlog
 
@@ -17,6 +22,8 @@ from core.config import settings
 from core.database import DatabaseManager
 from core.redis_client import RedisManager
 from core.logging_config import setup_logging
+from core.response_cache import ResponseCacheMiddleware
+from core.auth import AuthMiddleware
 from agents.agent_manager import AgentManager
 from api.routes import auth, recommendations, questions, users, conversations
 
@@ -25,6 +32,82 @@ from api.routes import auth, recommendations, questions, users, conversations
 setup_logging()
 logger = structlog.get_logger(__name__)
 
+HEALTH_CHECK_PATH = "/health"
+
+# 运行期间不变的配置项，导入时读取一次
+APP_NAME = settings.app_name
+APP_VERSION = settings.app_version
+ENVIRONMENT = settings.environment
+API_PREFIX = settings.api_prefix
+
+
+class HealthCheckAccessLogFilter(logging.Filter):
+    """从uvicorn访问日志中过滤健康检查探针请求"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        # uvicorn访问日志参数: (client_addr, method, path_with_query, http_version, status_code)
+        args = record.args
+        if isinstance(args, tuple) and len(args) >= 3 and isinstance(args[2], str):
+            return args[2].split("?", 1)[0] != HEALTH_CHECK_PATH
+        return True
+
+
+logging.getLogger("uvicorn.access").addFilter(HealthCheckAccessLogFilter())
+
+
+class InflightRequestMiddleware:
+    """统计处理中的HTTP请求数，关闭时据此等待请求完成后再释放连接池"""
+    
+    def __init__(self, app, state):
+        self.app = app
+        self.state = state
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        self.state.inflight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.state.inflight -= 1
+
+
+async def _wait_for_inflight_requests(app: FastAPI):
+    """等待处理中的请求结束，超时后继续关闭"""
+    deadline = time.monotonic() + settings.shutdown_drain_timeout
+    while app.state.inflight > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if app.state.inflight > 0:
+        logger.warning("等待处理中请求超时", inflight=app.state.inflight)
+
+
+async def _shutdown(app: FastAPI):
+    """按依赖顺序清理：先等请求结束，再清理Agent，最后关闭Redis和数据库"""
+    await _wait_for_inflight_requests(app)
+    
+    try:
+        # Agent任务可能仍在使用数据库和Redis，先于连接清理
+        if app.state.agent_manager is not None:
+            await app.state.agent_manager.cleanup()
+            logger.info("✅ Agent系统清理完成")
+    except Exception as e:
+        logger.error("❌ Agent系统清理出错", error=str(e), exc_info=True)
+    
+    # Redis、响应缓存连接池和数据库并发清理，单项失败不影响另一项
+    results = await asyncio.gather(
+        RedisManager.cleanup(),
+        response_cache_redis.aclose(),
+        DatabaseManager.cleanup(),
+        return_exceptions=True
+    )
+    for name, result in zip(("redis", "response_cache", "database"), results):
+        if isinstance(result, Exception):
+            logger.error("❌ 连接清理出错", service=name, error=str(result), exc_info=result)
+        else:
+            logger.info("✅ 连接清理完成", service=name)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -33,86 +116,121 @@ async def lifespan(app: FastAPI):
     logger.info("🚀 启动AI驱动学习系统...")
     
     try:
-        # 初始化数据库连接
-        await DatabaseManager.initialize()
-        logger.info("✅ 数据库连接初始化完成")
-        
-        # 初始化Redis连接
-        await RedisManager.initialize()
-        logger.info("✅ Redis连接初始化完成")
-        
-        # 初始化AI Agent管理器
+        # 数据库、Redis和AI Agent管理器互不依赖，并发初始化；
+        # 等待全部结束后再检查失败，避免某项失败时其余初始化仍在后台运行
         agent_manager = AgentManager()
-        await agent_manager.initialize()
         app.state.agent_manager = agent_manager
-        logger.info("✅ AutoGen Agent系统初始化完成")
+        results = await asyncio.gather(
+            DatabaseManager.initialize(),
+            RedisManager.initialize(),
+            agent_manager.initialize(),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # 已启动的组件由finally中的_shutdown统一清理
+            raise errors[0]
+        logger.info("✅ 数据库、Redis连接与AutoGen Agent系统初始化完成")
         
         logger.info("🎉 系统启动完成，所有服务就绪!")
         
         yield
         
     except Exception as e:
-        logger.error(f"❌ 系统启动失败: {e}", exc_info=True)
+        logger.error("❌ 系统启动失败", error=str(e), exc_info=True)
         raise
     
     finally:
-        # 关闭时清理
+        # 关闭时清理，shield保证清理流程不会被取消而中途停止
         logger.info("🛑 正在关闭系统...")
-        
-        try:
-            if hasattr(app.state, 'agent_manager'):
-                await app.state.agent_manager.cleanup()
-                logger.info("✅ Agent系统清理完成")
-            
-            await RedisManager.cleanup()
-            logger.info("✅ Redis连接清理完成")
-            
-            await DatabaseManager.cleanup()
-            logger.info("✅ 数据库连接清理完成")
-            
-        except Exception as e:
-            logger.error(f"❌ 系统关闭时出错: {e}", exc_info=True)
+        await asyncio.shield(_shutdown(app))
 
 
 # 创建FastAPI应用
 app = FastAPI(
-    title=settings.app_name,
-    version=settings.app_version,
+    title=APP_NAME,
+    version=APP_VERSION,
     description="基于AutoGen多Agent协作的智能软考刷题系统",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/api/docs" if settings.debug else None,
     redoc_url="/api/redoc" if settings.debug else None,
     openapi_url="/api/openapi.json" if settings.debug else None
 )
 
+# 启动完成前为None，lifespan中替换为实际的Agent管理器
+app.state.agent_manager = None
+app.state.inflight = 0
+
 # 添加中间件
+# 响应缓存先注册，位于CORS内层，缓存的响应不包含按Origin生成的CORS头；
+# 其连接池在_shutdown中关闭
+response_cache_redis = redis.from_url(settings.redis_url)
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.cors_origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    ResponseCacheMiddleware,
+    redis_client=response_cache_redis,
+    policies={f"{API_PREFIX}/questions": settings.response_cache_questions_ttl},
+    stale_ttl=settings.response_cache_stale_ttl
 )
 
+# 每个请求只解码一次令牌，路由依赖直接读取 request.state.user
+app.add_middleware(AuthMiddleware, path_prefix=API_PREFIX)
+
 app.add_middleware(
-    TrustedHostMiddleware, 
-    allowed_hosts=["localhost", "127.0.0.1", "*"]
+    CORSMiddleware,
+    allow_origins=tuple(settings.cors_origins),
+    allow_credentials=True,
+    allow_methods=tuple(settings.cors_allow_methods),
+    allow_headers=tuple(settings.cors_allow_headers),
 )
 
+# 只有配置了具体主机列表时才校验Host，通配符配置下该中间件没有意义
+if not settings.debug and settings.allowed_hosts:
+    app.add_middleware(
+        TrustedHostMiddleware,
+        allowed_hosts=settings.allowed_hosts
+    )
+
+# 最后注册，位于最外层，请求计数覆盖所有内层中间件
+app.add_middleware(InflightRequestMiddleware, state=app.state)
+
+
+class ErrorResponse(BaseModel):
+    """全局异常处理返回的错误响应体"""
+    error: bool = True
+    message: Any
+    status_code: int
+    path: Optional[str] = None
+    details: Optional[List[Dict[str, Any]]] = None
+
+
+# 各路由共用的错误响应声明和默认响应类
+ERROR_RESPONSES: Dict[int, Dict[str, Any]] = {
+    401: {"model": ErrorResponse},
+    422: {"model": ErrorResponse},
+    500: {"model": ErrorResponse}
+}
+ROUTER_DEFAULTS: Dict[str, Any] = {
+    "responses": ERROR_RESPONSES,
+    "default_response_class": ORJSONResponse
+}
+
 
 # 全局异常处理
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """HTTP异常处理"""
-    logger.error(
-        "HTTP异常",
-        path=request.url.path,
-        method=request.method,
-        status_code=exc.status_code,
-        detail=exc.detail
-    )
+    # 健康检查探针的非5xx异常不记录日志
+    if request.url.path != HEALTH_CHECK_PATH or exc.status_code >= 500:
+        logger.error(
+            "HTTP异常",
+            path=request.url.path,
+            method=request.method,
+            status_code=exc.status_code,
+            detail=exc.detail
+        )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "error": True,
@@ -123,22 +241,49 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     )
 
 
+# 验证异常日志采样：(路由, 首个错误类型) -> 上次记录时间
+_validation_log_at: Dict[Tuple[str, str], float] = {}
+_VALIDATION_LOG_MAX_KEYS = 1024
+
+
+def _should_log_validation_error(request: Request, errors: list) -> bool:
+    """同一路由的同类验证错误在间隔内只记录一次，避免错误洪峰下日志占满CPU和IO"""
+    if request.url.path == HEALTH_CHECK_PATH:
+        return False
+    
+    # 优先使用路由模板作键，路径参数不同的请求归为同一类
+    route = request.scope.get("route")
+    path = getattr(route, "path", request.url.path)
+    error_type = errors[0].get("type", "") if errors else ""
+    key = (path, error_type)
+    
+    now = time.monotonic()
+    if now - _validation_log_at.get(key, float("-inf")) < settings.validation_log_interval:
+        return False
+    if len(_validation_log_at) >= _VALIDATION_LOG_MAX_KEYS:
+        _validation_log_at.clear()
+    _validation_log_at[key] = now
+    return True
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     """请求验证异常处理"""
-    logger.error(
-        "请求验证异常",
-        path=request.url.path,
-        method=request.method,
-        errors=exc.errors()
-    )
+    errors = exc.errors()
+    if _should_log_validation_error(request, errors):
+        logger.error(
+            "请求验证异常",
+            path=request.url.path,
+            method=request.method,
+            errors=errors
+        )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=422,
         content={
             "error": True,
             "message": "请求参数验证失败",
-            "details": exc.errors(),
+            "details": errors,
             "status_code": 422
         }
     )
@@ -155,7 +300,7 @@ async def general_exception_handler(request: Request, exc: Exception):
         exc_info=True
     )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": True,
@@ -165,102 +310,158 @@ async def general_exception_handler(request: Request, exc: Exception):
     )
 
 
+# 健康检查结果缓存：探针高频访问时直接返回，过期后由一个请求负责刷新
+_health_cache: Dict[str, Any] = {"at": 0.0, "status_code": 200, "body": None}
+_health_lock = asyncio.Lock()
+
+
+def _cached_health_response() -> ORJSONResponse:
+    """由缓存的健康检查结果构建响应"""
+    return ORJSONResponse(status_code=_health_cache["status_code"], content=_health_cache["body"])
+
+
+def _health_cache_fresh() -> bool:
+    """缓存结果是否仍在有效期内"""
+    return (
+        _health_cache["body"] is not None
+        and time.monotonic() - _health_cache["at"] < settings.health_cache_ttl
+    )
+
+
 # 健康检查端点
-@app.get("/health")
+@app.get(HEALTH_CHECK_PATH)
 async def health_check():
-    """系统健康检查"""
+    """系统健康检查（结果短时间缓存）"""
+    if _health_cache_fresh():
+        return _cached_health_response()
+    
+    async with _health_lock:
+        # 等锁期间其他请求可能已经刷新
+        if not _health_cache_fresh():
+            status_code, body = await _run_health_checks()
+            _health_cache.update(at=time.monotonic(), status_code=status_code, body=body)
+    
+    return _cached_health_response()
+
+
+async def _run_health_checks() -> Tuple[int, Dict[str, Any]]:
+    """执行各子系统健康检查，返回状态码和响应体"""
     try:
-        # 检查数据库连接
-        db_status = await DatabaseManager.health_check()
-        
-        # 检查Redis连接
-        redis_status = await RedisManager.health_check()
+        # 并发检查数据库、Redis和Agent系统
+        agent_check = (
+            app.state.agent_manager.health_check()
+            if app.state.agent_manager is not None
+            else asyncio.sleep(0, result=True)
+        )
+        results = await asyncio.gather(
+            DatabaseManager.health_check(),
+            RedisManager.health_check(),
+            agent_check,
+            return_exceptions=True
+        )
         
-        # 检查Agent系统
-        agent_status = True
-        if hasattr(app.state, 'agent_manager'):
-            agent_status = await app.state.agent_manager.health_check()
+        # 单项检查抛出异常视为该项不可用
+        for name, result in zip(("database", "redis", "agents"), results):
+            if isinstance(result, Exception):
+                logger.error("子系统健康检查异常", service=name, error=str(result))
+        db_status, redis_status, agent_status = (
+            False if isinstance(result, Exception) else result for result in results
+        )
         
-        return {
+        return 200, {
             "status": "healthy",
-            "version": settings.app_version,
+            "version": APP_VERSION,
             "services": {
                 "database": "ok" if db_status else "error",
                 "redis": "ok" if redis_status else "error", 
                 "agents": "ok" if agent_status else "error"
             },
-            "environment": settings.environment,
-            "timestamp": asyncio.get_event_loop().time()
+            "environment": ENVIRONMENT,
+            "timestamp": time.time()
         }
         
     except Exception as e:
-        logger.error(f"健康检查失败: {e}")
-        return JSONResponse(
-            status_code=503,
-            content={
-                "status": "unhealthy",
-                "error": str(e),
-                "timestamp": asyncio.get_event_loop().time()
-            }
-        )
+        logger.error("健康检查失败", error=str(e))
+        return 503, {
+            "status": "unhealthy",
+            "error": str(e),
+            "timestamp": time.time()
+        }
+
+
+# 系统信息在运行期间不变，导入时序列化一次
+_SYSTEM_INFO_BYTES = orjson.dumps({
+    "name": APP_NAME,
+    "version": APP_VERSION,
+    "environment": ENVIRONMENT,
+    "api_prefix": API_PREFIX,
+    "features": {
+        "ai_recommendation": True,
+        "user_profiling": True,
+        "intelligent_explanation": True,
+        "multi_turn_conversation": True,
+        "knowledge_graph": True
+    }
+})
 
 
 # 系统信息端点
 @app.get("/info")
 async def system_info():
     """系统信息"""
-    return {
-        "name": settings.app_name,
-        "version": settings.app_version,
-        "environment": settings.environment,
-        "api_prefix": settings.api_prefix,
-        "features": {
-            "ai_recommendation": True,
-            "user_profiling": True,
-            "intelligent_explanation": True,
-            "multi_turn_conversation": True,
-            "knowledge_graph": True
-        }
-    }
+    return Response(content=_SYSTEM_INFO_BYTES, media_type="application/json")
 
 
 # 注册API路由
 app.include_router(
     auth.router,
-    prefix=settings.api_prefix + "/auth",
-    tags=["认证"]
+    prefix=f"{API_PREFIX}/auth",
+    tags=["认证"],
+    **ROUTER_DEFAULTS
 )
 
 app.include_router(
     users.router,
-    prefix=settings.api_prefix + "/users",
-    tags=["用户管理"]
+    prefix=f"{API_PREFIX}/users",
+    tags=["用户管理"],
+    **ROUTER_DEFAULTS
 )
 
 app.include_router(
     questions.router,
-    prefix=settings.api_prefix + "/questions",
-    tags=["题目管理"]
+    prefix=f"{API_PREFIX}/questions",
+    tags=["题目管理"],
+    **ROUTER_DEFAULTS
 )
 
 app.include_router(
     recommendations.router,
-    prefix=settings.api_prefix + "/recommendations",
-    tags=["智能推荐"]
+    prefix=f"{API_PREFIX}/recommendations",
+    tags=["智能推荐"],
+    **ROUTER_DEFAULTS
 )
 
 app.include_router(
     conversations.router,
-    prefix=settings.api_prefix + "/conversations",
-    tags=["对话交互"]
+    prefix=f"{API_PREFIX}/conversations",
+    tags=["对话交互"],
+    **ROUTER_DEFAULTS
 )
 
 
 if __name__ == "__main__":
+    # 本地开发入口（单进程）；生产环境使用 gunicorn main:app -c gunicorn_conf.py
+    # 单进程没有主进程负责重启，不设置 limit_max_requests，Worker回收交给gunicorn
+    # 部署在反向代理之后时，可加 proxy_headers=True, forwarded_allow_ips="代理地址" 以获取真实客户端IP
     uvicorn.run(
         "main:app",
         host=settings.api_host,
         port=settings.api_port,
         reload=settings.debug,
-        log_level=settings.log_level.lower()
+        log_level=settings.log_level.lower(),
+        loop="uvloop",
+        http="httptools",
+        timeout_keep_alive=settings.api_keepalive_timeout,
+        limit_concurrency=settings.api_limit_concurrency,
+        backlog=settings.api_backlog
     )
\ No newline at end of file